@@ -0,0 +1,124 @@
+import os
+import time
+import tempfile
+import numpy as np
+from libs.cdf import cdf, close_cdf
+import libs.epoch as epoch
+import system.manager as smg
+
+# Benchmarks on synthetic data, to be run as a script like main.py.
+
+
+def make_files(
+    file_dir,
+    nfile=96,
+    nrec=100000,
+    cadence=15*60,
+    time0=1388534400.,
+):
+    """
+    Write a set of CDFs like the 15-min EFW vb1-split files: unix_time and
+    a [nrec,3] float32 var named vb1, with DEPEND_0 set to unix_time.
+    :return: a list of the file names.
+    """
+
+    files = list()
+    dt = cadence/nrec
+    for i in range(nfile):
+        file = os.path.join(file_dir, f'bench_{i:04d}_v01.cdf')
+        files.append(file)
+        if os.path.exists(file): continue
+        times = time0+i*cadence+np.arange(nrec)*dt
+        cdfid = cdf(file)
+        cdfid.save_var('unix_time', times, data_type='CDF_DOUBLE',
+            settings={'UNITS': 'sec'})
+        cdfid.save_var('vb1', np.float32(np.random.randn(nrec,3)), data_type='CDF_FLOAT',
+            settings={'UNITS': 'V', 'DEPEND_0': 'unix_time'})
+        cdfid.close()
+    return files
+
+
+def bench_parallel_read(
+    all_workers=[1,2,4,8],
+    executors=['thread','process'],
+    nfile=96,
+    nrec=100000,
+    file_dir=None,
+):
+
+    if file_dir is None:
+        file_dir = os.path.join(tempfile.gettempdir(), 'pyslib_bench')
+    files = make_files(file_dir, nfile=nfile, nrec=nrec)
+
+    # Time the per-file reads only, i.e., without time conversion etc.
+    rec_range = [[] for file in files]
+    for executor in executors:
+        for workers in all_workers:
+            close_cdf()
+            tic = time.perf_counter()
+            smg._cdf_read_var('vb1', files, rec_range=rec_range,
+                workers=workers, executor=executor)
+            toc = time.perf_counter()
+            print(f'{executor:<8}{workers:>2} workers: {toc-tic:0.4f} seconds for {nfile} files')
+
+
+def bench_tt2000(
+    nrec=10**7,
+    time0=1388534400.,
+    cadence=1/32,
+):
+    """
+    Convert TT2000 to unix time, with numpy and through astropy as before.
+    """
+
+    times = epoch.unix_to_tt2000(time0+np.arange(nrec)*cadence)
+
+    tic = time.perf_counter()
+    unix = epoch.convert_time(times, input='CDF_TIME_TT2000', output='unix')
+    toc = time.perf_counter()
+    print(f'numpy  : {toc-tic:0.4f} seconds for {nrec} TT2000 values')
+
+    tic = time.perf_counter()
+    unix_astropy = epoch.from_time(epoch.to_time(times, 'tt2000'), 'unix')
+    toc = time.perf_counter()
+    print(f'astropy: {toc-tic:0.4f} seconds for {nrec} TT2000 values')
+    print(f'max difference: {np.max(np.abs(unix-unix_astropy)):0.3g} seconds')
+
+
+def bench_cotran(
+    nrec=86400*365,
+    nrec_pyspedas=86400,
+    time0=1388534400.,
+    path=['gse','sm'],
+):
+    """
+    Transform a year of 1-sec orbit data, with libs.cotran and cotrans_lib.
+    cotrans_lib is run on the first nrec_pyspedas records, which takes long enough.
+    """
+    from libs.cotran import cotran
+    from pyspedas.cotrans import cotrans_lib
+
+    times = time0+np.arange(nrec)
+    # An orbit of 9 hours.
+    phase = 2*np.pi*times/(9*3600)
+    vec = np.stack([np.cos(phase)*3, np.sin(phase)*5, np.sin(phase)*0.5], axis=1)
+
+    tic = time.perf_counter()
+    cotran(vec, times, input=path[0], output=path[1])
+    toc = time.perf_counter()
+    print(f'libs.cotran : {toc-tic:0.4f} seconds for {nrec} records, {path[0]} to {path[1]}')
+
+    tic = time.perf_counter()
+    cotrans_lib.subcotrans(list(times[:nrec_pyspedas]), list(vec[:nrec_pyspedas]), path[0], path[1])
+    toc = time.perf_counter()
+    print(f'cotrans_lib : {toc-tic:0.4f} seconds for {nrec_pyspedas} records, {path[0]} to {path[1]}')
+
+
+def main():
+    bench_parallel_read()
+    bench_tt2000()
+    bench_cotran()
+
+
+if __name__ == '__main__':
+    main()
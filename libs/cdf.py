@@ -1,5 +1,9 @@
 import ctypes
 import os
+import atexit
+import bisect
+import threading
+from collections import OrderedDict
 from datetime import datetime
 import numpy as np
 from spacepy import pycdf   # https://github.com/spacepy/spacepy/blob/master/spacepy/pycdf/
@@ -35,6 +39,7 @@ valid_cdf_type = {
     52: 'CDF_UCHAR',
 }
 valid_cdf_type_code = list(valid_cdf_type.keys())
+epoch_cdf_type = ['CDF_EPOCH','CDF_EPOCH16','CDF_TIME_TT2000']
 valid_cdf_type_str = list(valid_cdf_type.values())
 
 def get_cdf_type_str(code):
@@ -43,6 +48,32 @@ def get_cdf_type_code(str):
     return valid_cdf_type_code[valid_cdf_type_str.index(str.upper())]
 
 
+valid_dtype = {
+    'CDF_INT1':         np.int8,
+    'CDF_INT2':         np.int16,
+    'CDF_INT4':         np.int32,
+    'CDF_INT8':         np.int64,
+    'CDF_UINT1':        np.uint8,
+    'CDF_UINT2':        np.uint16,
+    'CDF_UINT4':        np.uint32,
+    'CDF_REAL4':        np.float32,
+    'CDF_REAL8':        np.float64,
+    'CDF_EPOCH':        np.float64,
+    'CDF_EPOCH16':      np.complex128,
+    'CDF_TIME_TT2000':  np.int64,
+    'CDF_BYTE':         np.int8,
+    'CDF_FLOAT':        np.float32,
+    'CDF_DOUBLE':       np.float64,
+    'CDF_CHAR':         np.bytes_,
+    'CDF_UCHAR':        np.bytes_,
+}
+
+def get_dtype(cdf_type, nelem=1):
+    dtype = valid_dtype[cdf_type]
+    if dtype is np.bytes_: return np.dtype(('S', nelem))
+    return np.dtype(dtype)
+
+
 valid_coding = {
     1:  'NETWORK',
     2:  'SUN',
@@ -63,6 +94,9 @@ valid_coding = {
     18: 'ARM_BIG',
 }
 
+# Encodings with IEEE floats, which numpy reads. VAX and the Alpha VMS d/g encodings are not.
+ieee_coding = [1,2,4,5,6,7,8,9,11,12,13,16,17,18,19]
+
 valid_checksum = {
     0: 'NO_CHECKSUM',
     1: 'MD5_CHECKSUM',
@@ -103,33 +137,72 @@ valid_compression = {
 }
 
 
+# The CDF shared library is located and loaded once per process.
+_library = None
+
+def get_library():
+    global _library
+    if _library is None:
+        _libpath, _lib = pycdf.Library._find_lib()
+        _library = pycdf.Library(_libpath, _lib)
+    return _library
+
+
 class cdf():
     filename = None
     _pycdf = None
     _cdflib = None
     
-    def __init__(self, filename):
+    def __init__(self, filename, readonly=False):
         self.filename = filename
         if not os.path.exists(filename):
+            if readonly:
+                raise FileNotFoundError(f'{filename} does not exist ...')
             os.makedirs(os.path.dirname(filename), exist_ok=True)
             file = pycdf.CDF(filename, create=True)
             file.close()
         
-        self._pycdf = pycdf.CDF(filename, create=False, readonly=False)
-        _libpath, _library = pycdf.Library._find_lib()
-        self.lib = pycdf.Library(_libpath, _library)
-        self._cdflib = cdflib.CDF(filename)
-        self.cdf_info = self._cdflib.cdf_info()
+        self._pycdf = pycdf.CDF(filename, create=False, readonly=readonly)
+        self.lib = get_library()
+        self._cache = dict()
+        self._get_cdflib()
 
 
     def __del__(self):
-        self._pycdf.close()
+        self.close()
+
+    def close(self):
+        if self._pycdf is None: return
+        pycdf_file, self._pycdf = self._pycdf, None
+        try:
+            pycdf_file.close()
+        except AttributeError:
+            # At interpreter shutdown, the CDF library may be unloaded already.
+            pass
+
+    def _get_cdflib(self):
+        # cdflib parses the file once, so it has to be reopened after writing.
+        if self._cdflib is None:
+            self._cdflib = cdflib.CDF(self.filename)
+            self.cdf_info = self._cdflib.cdf_info()
+        return self._cdflib
+
+    def _clear_cache(self):
+        # Metadata are read lazily and cached, any write invalidates them.
+        self._cache = dict()
+        self._cdflib = None
+
+    def _cached(self, key, func):
+        if key not in self._cache:
+            self._cache[key] = func()
+        return self._cache[key]
 
     def gatts(self):
-        return list(self._pycdf.attrs.keys())
+        return list(self.read_setting().keys())
 
     def vatts(self):
         _vatts = list()
+        self._get_cdflib()
         atts = self.cdf_info['Attributes']
         for att in atts:
             for a in att:
@@ -140,49 +213,59 @@ class cdf():
 
     def read_setting(self, var=None):
         if var is None:
-            return dict(self._pycdf.attrs)
+            return dict(self._cached('gatt', lambda: dict(self._pycdf.attrs)))
         else:
             return self.read_var_att(var)
 
     def vars(self):
-        return list(self._pycdf.keys())
+        return list(self._cached('vars', lambda: list(self._pycdf.keys())))
 
     def has_var(self, var):
-        return var in self.vars()
+        return var in self._cached('var_set', lambda: set(self.vars()))
 
-    def read_var(self, var='', range=[], step=1):
+    def read_var(self, var='', range=[], step=1, backend='pycdf', mmap=False):
+        """
+        Read data of a var.
+        :param range: [start,end) record indices, or [rec], or [] for all.
+        :param step: read every step-th record.
+        :param backend: 'pycdf' or 'cdflib'. cdflib keeps its own file handle
+            and state, so it can be used from different threads for different
+            files, whereas the CDF library behind pycdf cannot.
+        :param mmap: set to return a view of np.memmap instead of a copy, if
+            the var is stored uncompressed, not sparse, in a single-file and
+            row-major CDF. Otherwise the data are read as usual.
+        Epoch types are returned as raw numbers: float64 for CDF_EPOCH,
+        complex128 (seconds + 1j*picoseconds) for CDF_EPOCH16 as in cdflib,
+        and int64 for CDF_TIME_TT2000. Use libs.epoch to convert them.
+        """
         if not self.has_var(var):
             raise Exception(f'{var} is not found ...')
 
         # pycdf converts time to datetime.
         # This is way too smart... 
         var_info = self.read_var_info(var)
+        data_type = var_info['cdf_type']
 
         # If rec not vary.
         if not var_info['rec_vary']:
+            if data_type in epoch_cdf_type:
+                return self._read_raw_epoch(var, data_type)
             return (self._pycdf[var])[...]
             
 
         # Work on range.
-        maxrec = var_info['maxrec']
-        nrange = len(range)
-        if len(range) > 2:
-            raise Exception(f'Invalid range: {range} ...')
-        _range = range.copy()
-        if nrange == 1:
-            _range.append(_range[0]+1)
-        elif nrange == 0:
-            _range = [0,maxrec]
-        else:
-            _range.sort()
-        _range = np.clip(_range, 0, maxrec)
+        _range = self._prepare_range(var_info, range)
 
 
         # Read data.
-        data_type = var_info['cdf_type']
-        if data_type in ['CDF_EPOCH','CDF_EPOCH16','CDF_TT2000']:
-            data = self._cdflib.varget(var, startrec=_range[0], endrec=_range[1]-1)
-            return data[::step]
+        if mmap:
+            data = self._read_var_mmap(var, _range, step)
+            if data is not None: return data
+        if backend == 'cdflib':
+            nrec = self.count_rec(var, range, step)
+            return _varget(self._get_cdflib(), var, _range, step, nrec, self._var_dims(var_info))
+        elif data_type in epoch_cdf_type:
+            return self._read_raw_epoch(var, data_type, _range, step)
         else:
             data = self._pycdf[var][_range[0]:_range[1]:step]
             return data[...]
@@ -199,17 +282,111 @@ class cdf():
 
 
 
+    def _read_raw_epoch(self, var, data_type, range=None, step=1):
+        # Read the numbers as stored, without pycdf's conversion to datetime.
+        # A var not varying by record is read whole, it may not be sliced, e.g., a scalar.
+        if range is None:
+            data = self._pycdf.raw_var(var)[...]
+        else:
+            data = self._pycdf.raw_var(var)[range[0]:range[1]:step]
+        data = np.asarray(data)
+        if data_type == 'CDF_EPOCH16':
+            data = data[...,0]+1j*data[...,1]
+        return data
+
+
+    def _var_dims(self, var_info):
+        dims = list(var_info['dims'])
+        if dims == [0]: dims = []
+        return dims
+
+    def _prepare_range(self, var_info, range=[]):
+        # maxrec is the index of the last record, the range excludes its end.
+        nrec = var_info['maxrec']+1
+        nrange = len(range)
+        if len(range) > 2:
+            raise Exception(f'Invalid range: {range} ...')
+        _range = list(range).copy()
+        if nrange == 1:
+            _range.append(_range[0]+1)
+        elif nrange == 0:
+            _range = [0,nrec]
+        else:
+            _range.sort()
+        return np.clip(_range, 0, nrec)
+
+    def count_rec(self, var='', range=[], step=1):
+        """
+        Return the number of records read_var returns for the same inputs.
+        """
+        var_info = self.read_var_info(var)
+        if not var_info['rec_vary']: return 1
+        _range = self._prepare_range(var_info, range)
+        return len(np.arange(_range[0], _range[1], step))
+
+    def iter_var(self, var='', range=[], step=1, chunk_records=1000000, **kwargs):
+        """
+        Read data of a var in chunks, to process data larger than memory.
+        :param chunk_records: the max number of records in each chunk.
+        :param kwargs: passed to read_var, e.g., backend, mmap.
+        :return: a generator of data in chunks.
+        """
+        var_info = self.read_var_info(var)
+        if not var_info['rec_vary']:
+            yield self.read_var(var)
+            return
+
+        _range = self._prepare_range(var_info, range)
+        # Each chunk starts on the stride of the previous one.
+        chunk_size = chunk_records*step
+        for rec0 in np.arange(_range[0], _range[1], chunk_size):
+            rec1 = min(rec0+chunk_size, _range[1])
+            yield self.read_var(var, [rec0,rec1], step, **kwargs)
+
+    def _read_var_mmap(self, var, range, step=1):
+        layout = self._cached(('layout',var), lambda: read_var_layout(self.filename, var))
+        if layout is None: return None
+        return _read_layout(self.filename, layout, range, step)
+
+    def plan_read(self, var='', range=[], step=1, mmap=False):
+        """
+        Resolve the metadata to read a record-varying var, for read_planned.
+        :param range: as in read_var.
+        :param mmap: set to map the data from disk if possible, as in read_var.
+        :return: a dict of the var, range, step, nrec, dims, and the layout or None.
+        """
+        var_info = self.read_var_info(var)
+        layout = None
+        if mmap: layout = self._cached(('layout',var), lambda: read_var_layout(self.filename, var))
+        return dict(var=var, range=self._prepare_range(var_info, range), step=step,
+            nrec=self.count_rec(var, range, step), dims=self._var_dims(var_info), layout=layout)
+
+    def search_rec(self, var, value, side='left', lo=0, hi=None):
+        """
+        Binary search a monotonic var on disk, reading one record per probe.
+        :param side: 'left' or 'right', as in np.searchsorted.
+        :return: the index where value would be inserted to keep the order.
+        """
+        if hi is None: hi = self.count_rec(var)
+        records = _Records(self, var)
+        if side == 'left':
+            return bisect.bisect_left(records, value, lo, hi)
+        else:
+            return bisect.bisect_right(records, value, lo, hi)
+
     def read_var_att(self, var=''):
         if not self.has_var(var):
             raise Exception(f'{var} is not found ...')
-        return dict(self._pycdf[var].attrs)
+        return dict(self._cached(('vatt',var), lambda: dict(self._pycdf[var].attrs)))
 
     def read_var_info(self, var=''):
         if not self.has_var(var):
             raise Exception(f'{var} is not found ...')
 
-        the_cdf = cdflib.CDF(self.filename)
-        var_info = the_cdf.varinq(var)
+        return dict(self._cached(('var_info',var), lambda: self._read_var_info(var)))
+
+    def _read_var_info(self, var):
+        var_info = self._get_cdflib().varinq(var)
         dim_vary = var_info['Dim_Vary']
 #        dim_vary = [int(x != 0) for x in dim_vary]
         dim_vary = [valid_dim_vary[x] for x in dim_vary]
@@ -231,12 +408,14 @@ class cdf():
         if not self.has_var(var):
             return
         del self._pycdf[var]
+        self._clear_cache()
 
     def del_setting(self, key, var=None):
         if var is None:
             self._pycdf.attrs.pop(key, None)
         else:
             self._pycdf[var].attrs.pop(key, None)
+        self._clear_cache()
 
     def rename_setting(self, key, to='', var=None):
         if var is None:
@@ -245,6 +424,7 @@ class cdf():
         else:
             val = self._pycdf[var].attrs.pop(key, None)
             if val is not None: self._pycdf[var].attrs[to] = val
+        self._clear_cache()
 
     def save_setting(self, var=None, settings=None):
         if var is None:
@@ -252,6 +432,7 @@ class cdf():
         else:
             if self.has_var(var):
                 self._pycdf[var].attrs.update(settings)
+        self._clear_cache()
 
     
     def save_data(self, var, value=None, settings=None):
@@ -266,6 +447,7 @@ class cdf():
             raise Exception(f'{var} is not found ...')
         
         self._pycdf[var][...] = value
+        self._clear_cache()
 
         if settings is not None:
             self.save_setting(var, settings=settings)
@@ -322,6 +504,7 @@ class cdf():
             self._pycdf.new(var, data=value, type=data_type,
             recVary=rec_vary, n_elements=numelem,
             dims=dimensions, dimVarys=dim_vary)
+        self._clear_cache()
     
 
         if settings is not None:
@@ -331,12 +514,13 @@ class cdf():
         if not self.has_var(var):
             raise Exception(f'{var} is not found ...')
         self._pycdf[var].rename(to)
+        self._clear_cache()
 
     def read_skeleton(self):
         skeleton = dict()
 
-        the_cdf = cdflib.CDF(self.filename)
-        cdf_info = the_cdf.cdf_info()
+        self._get_cdflib()
+        cdf_info = self.cdf_info
 
         # Version string.
         version = ctypes.c_long(0)
@@ -422,11 +606,11 @@ class cdf():
         # This part is not well tested.
         for var in cdf_info['rVariables']:
             vars[var] = self.read_var_info(var)
-            vars[var]['setting'] = the_cdf.varattsget(var)
+            vars[var]['setting'] = self.read_var_att(var)
 
         for var in cdf_info['zVariables']:
             vars[var] = self.read_var_info(var)
-            vars[var]['setting'] = the_cdf.varattsget(var)
+            vars[var]['setting'] = self.read_var_att(var)
         skeleton['vars'] = vars
 
         return skeleton
@@ -500,6 +684,226 @@ class cdf():
                 print(s)
 
 
+def read_var_layout(filename, var):
+    """
+    Find where the records of a var are in the file, by parsing the internal
+    records of a CDF (https://cdf.gsfc.nasa.gov/html/cdf_docs.html).
+    :return: None if the var cannot be memory mapped, i.e., it is not an
+        uncompressed and not sparse var in an uncompressed, single-file,
+        row-major, version 3 CDF. Otherwise a dict of the dtype, rec_shape,
+        and blocks, which are [first_rec, last_rec, data_offset] sorted by
+        first_rec, with no gap in between.
+    """
+
+    def read_int(f, offset, size=4):
+        f.seek(offset)
+        return int.from_bytes(f.read(size), 'big', signed=True)
+
+    with open(filename, 'rb') as f:
+        # Magic numbers: version 3, and not compressed.
+        magic = f.read(8).hex()
+        if magic != 'cdf300010000ffff': return None
+
+        # CDR.
+        cdr = 8
+        gdr = read_int(f, cdr+12, 8)
+        encoding = read_int(f, cdr+28)
+        flags = read_int(f, cdr+32)
+        row_major = flags & 1
+        single_file = flags & 2
+        if not (row_major and single_file): return None
+        if encoding not in ieee_coding: return None
+        big_endian = encoding in [1,2,5,7,9,11,12,18]
+        byte_order = '>' if big_endian else '<'
+
+        # GDR.
+        rvdr = read_int(f, gdr+12, 8)
+        zvdr = read_int(f, gdr+20, 8)
+        nrdim = read_int(f, gdr+56)
+        rdim_sizes = [read_int(f, gdr+84+4*i) for i in range(nrdim)]
+
+        # Find the VDR of the var.
+        vdr = None
+        for head in [zvdr, rvdr]:
+            offset = head
+            while offset > 0:
+                f.seek(offset+84)
+                name = f.read(256).split(b'\x00')[0].decode()
+                if name == var:
+                    vdr = offset
+                    break
+                offset = read_int(f, offset+12, 8)
+            if vdr is not None: break
+        if vdr is None: return None
+
+        # VDR.
+        is_zvar = read_int(f, vdr+8) == 8
+        data_type = read_int(f, vdr+20)
+        vxr = read_int(f, vdr+28, 8)
+        var_flags = read_int(f, vdr+44)
+        sparse = read_int(f, vdr+48)
+        nelem = read_int(f, vdr+64)
+        if var_flags & 4 or sparse != 0: return None
+        if is_zvar:
+            ndim = read_int(f, vdr+340)
+            dim_sizes = [read_int(f, vdr+344+4*i) for i in range(ndim)]
+            dim_varys = [read_int(f, vdr+344+4*(ndim+i)) for i in range(ndim)]
+        else:
+            dim_sizes = rdim_sizes
+            dim_varys = [read_int(f, vdr+340+4*i) for i in range(nrdim)]
+        rec_shape = [size for size, vary in zip(dim_sizes,dim_varys) if vary != 0]
+
+        cdf_type = valid_cdf_type.get(data_type, None)
+        if cdf_type is None: return None
+        if cdf_type in ['CDF_CHAR','CDF_UCHAR']: return None
+        dtype = get_dtype(cdf_type).newbyteorder(byte_order)
+
+        # VXRs, which point to VVRs or to more VXRs.
+        blocks = list()
+        vxrs = [vxr]
+        while len(vxrs) > 0:
+            offset = vxrs.pop()
+            while offset > 0:
+                nentry = read_int(f, offset+20)
+                nused = read_int(f, offset+24)
+                for i in range(nused):
+                    first = read_int(f, offset+28+4*i)
+                    last = read_int(f, offset+28+4*(nentry+i))
+                    the_offset = read_int(f, offset+28+8*nentry+8*i, 8)
+                    record_type = read_int(f, the_offset+8)
+                    if record_type == 6:
+                        vxrs.append(the_offset)
+                    elif record_type == 7:
+                        blocks.append([first, last, the_offset+12])
+                    else:
+                        return None
+                offset = read_int(f, offset+12, 8)
+
+    blocks.sort()
+    for i in range(1,len(blocks)):
+        if blocks[i][0] != blocks[i-1][1]+1: return None
+
+    return {
+        'dtype': dtype,
+        'rec_shape': rec_shape,
+        'blocks': blocks,
+    }
+
+
+class _Records():
+    # Sequence view of a var, reads a record only when it is indexed.
+    def __init__(self, cdfid, var):
+        self.cdfid = cdfid
+        self.var = var
+
+    def __len__(self):
+        return self.cdfid.count_rec(self.var)
+
+    def __getitem__(self, index):
+        return self.cdfid.read_var(self.var, [index])[0]
+
+
+def _varget(cdflib_file, var, range, step, nrec, dims):
+    # Read [start,end) records on step with cdflib.
+    if nrec == 0: return np.empty([0]+dims)
+    data = cdflib_file.varget(var, startrec=range[0], endrec=range[1]-1)
+    # cdflib drops the record dimension for a single record.
+    data = np.asarray(data)
+    if range[1]-range[0] > 1: data = data[::step]
+    return np.reshape(data, [nrec]+dims)
+
+def _read_layout(filename, layout, range, step=1):
+    # Map [start,end) records on step, from the blocks of read_var_layout.
+    dtype = layout['dtype']
+    rec_shape = layout['rec_shape']
+    data = list()
+    rec0, rec1 = range
+    for first, last, offset in layout['blocks']:
+        if last < rec0: continue
+        if first >= rec1: break
+        block = np.memmap(filename, dtype=dtype, mode='r', offset=offset,
+            shape=tuple([last-first+1]+rec_shape))
+        # Keep the records on the same stride across blocks.
+        the_rec0 = max(rec0, first)
+        the_rec0 += (rec0-the_rec0) % step
+        the_rec1 = min(rec1, last+1)
+        data.append(block[the_rec0-first:the_rec1-first:step])
+    if len(data) == 0: return np.empty([0]+rec_shape, dtype=dtype)
+    # Only the requested records are copied when they span blocks.
+    if len(data) == 1: return data[0]
+    return np.concatenate(data, axis=0)
+
+def read_planned(filename, plans):
+    """
+    Read vars of a file from plans of cdf.plan_read, with cdflib or np.memmap only.
+    The CDF library behind pycdf is not thread-safe, so threads read this way,
+    after the plans are made in the calling thread.
+    :return: a list of data, one for each plan.
+    """
+    cdflib_file = None
+    data = list()
+    for plan in plans:
+        if plan['layout'] is not None:
+            data.append(_read_layout(filename, plan['layout'], plan['range'], plan['step']))
+            continue
+        # cdflib keeps its own file handle, one for each call.
+        if cdflib_file is None and plan['nrec'] != 0: cdflib_file = cdflib.CDF(filename)
+        data.append(_varget(cdflib_file, plan['var'], plan['range'], plan['step'], plan['nrec'], plan['dims']))
+    return data
+
+
+# A process-wide pool of read-only handles, keyed by path.
+# Each entry remembers the mtime and size of the file when it was opened,
+# so a file that has been rewritten since is reopened instead of reused.
+max_open_files = 64
+_open_files = OrderedDict()
+_open_files_lock = threading.RLock()
+
+def _file_stamp(filename):
+    stat = os.stat(filename)
+    return (stat.st_mtime_ns, stat.st_size)
+
+def open_cdf(filename):
+    """
+    Return an open, read-only cdf for the given file from the pool.
+    :param filename: a string of the full file name.
+    :return: a cdf object. Do not close it, use close_cdf instead.
+    """
+    path = os.path.abspath(filename)
+    stamp = _file_stamp(path)
+    with _open_files_lock:
+        if path in _open_files:
+            the_stamp, cdfid = _open_files[path]
+            if the_stamp == stamp:
+                _open_files.move_to_end(path)
+                return cdfid
+            close_cdf(path)
+
+        cdfid = cdf(path, readonly=True)
+        _open_files[path] = (stamp, cdfid)
+        while len(_open_files) > max_open_files:
+            _, (_, old_cdfid) = _open_files.popitem(last=False)
+            old_cdfid.close()
+        return cdfid
+
+def close_cdf(filename=None):
+    """
+    Close and evict a file from the pool. Close all files if no file is given.
+    """
+    with _open_files_lock:
+        if filename is None:
+            paths = list(_open_files.keys())
+        else:
+            paths = [os.path.abspath(filename)]
+        for path in paths:
+            if path not in _open_files: continue
+            _, cdfid = _open_files.pop(path)
+            cdfid.close()
+
+# Close the pool at exit, while the CDF library is still loaded.
+atexit.register(close_cdf)
+
+
 ## Test shows that both pycdf and cdflib start to use a lot of memory when loading variables.
 ## pycdf takes about half the time of cdflib to load several GB of data.
 #
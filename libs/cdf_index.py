@@ -0,0 +1,110 @@
+import os
+import numpy as np
+from libs.cdf import open_cdf
+
+"""
+A persistent index of the time var of CDFs, to find record ranges without reading the full time var.
+
+The index of a file is saved next to it, in .pyslib_index/<file>.<time_var>.npz. It records the mtime and size of the file, the number of records, the first and last times, the cadence, and the time of every index_stride-th record.
+Files are indexed on first use. When the data directory is not writable, the index is kept in memory only.
+"""
+
+index_dir_name = '.pyslib_index'
+index_stride = 4096
+
+# In memory copies of the index, keyed by (file, time_var).
+_indexes = dict()
+
+
+def _file_stamp(file):
+    stat = os.stat(file)
+    return np.array([stat.st_mtime_ns, stat.st_size], dtype=np.int64)
+
+
+def index_file(file, time_var):
+    """
+    Return the file name of the index for a file and a time var.
+    """
+    path = os.path.abspath(file)
+    base = os.path.basename(path)+'.'+time_var+'.npz'
+    return os.path.join(os.path.dirname(path), index_dir_name, base)
+
+
+def build_index(file, time_var):
+    """
+    Read the full time var once and return its index.
+    """
+    times = open_cdf(file).read_var(time_var)
+    nrec = len(times)
+    recs = np.arange(0, nrec, index_stride)
+    if nrec > 0 and recs[-1] != nrec-1:
+        recs = np.append(recs, nrec-1)
+    if nrec > 1:
+        cadence = np.median(np.diff(times))
+    else:
+        cadence = np.zeros(1, dtype=times.dtype)[0]
+    return {
+        'stamp': _file_stamp(file),
+        'nrec': nrec,
+        'first_time': times[0] if nrec > 0 else None,
+        'last_time': times[-1] if nrec > 0 else None,
+        'cadence': cadence,
+        'recs': recs,
+        'times': times[recs],
+    }
+
+
+def save_index(file, time_var, index):
+    if index['nrec'] == 0: return
+    # Only plain numbers can be loaded back without pickle.
+    if index['times'].dtype.hasobject: return
+    the_file = index_file(file, time_var)
+    tmp_file = the_file+'.tmp.npz'
+    try:
+        os.makedirs(os.path.dirname(the_file), exist_ok=True)
+        np.savez(tmp_file, **index)
+        os.replace(tmp_file, the_file)
+    except OSError:
+        pass
+
+
+def read_index(file, time_var):
+    the_file = index_file(file, time_var)
+    if not os.path.exists(the_file): return None
+    try:
+        with np.load(the_file, allow_pickle=False) as f:
+            index = dict(f)
+    except (OSError, ValueError):
+        return None
+    index['nrec'] = int(index['nrec'])
+    return index
+
+
+def load_index(file, time_var):
+    """
+    Return the index of a file and a time var. It is built and saved if there is no valid index.
+    :return: a dict of stamp, nrec, first_time, last_time, cadence, recs, and times.
+    """
+    key = (os.path.abspath(file), time_var)
+    stamp = _file_stamp(file)
+
+    index = _indexes.get(key, None)
+    if index is None or not np.array_equal(index['stamp'], stamp):
+        index = read_index(file, time_var)
+    if index is None or not np.array_equal(index['stamp'], stamp):
+        index = build_index(file, time_var)
+        save_index(file, time_var, index)
+    _indexes[key] = index
+    return index
+
+
+def search_rec(file, time_var, index, value, side='left'):
+    """
+    Same as cdf.search_rec, but reads only the records between two index entries.
+    """
+    recs = index['recs']
+    i = np.searchsorted(index['times'], value, side=side)
+    lo = 0 if i == 0 else recs[i-1]+1
+    hi = index['nrec'] if i == len(recs) else recs[i]
+    if lo >= hi: return int(hi)
+    return open_cdf(file).search_rec(time_var, value, side=side, lo=int(lo), hi=int(hi))
@@ -1,8 +1,461 @@
+import numpy as np
+from functools import lru_cache
+from collections import OrderedDict
 from pyspedas.cotrans import cotrans_lib
+from pyspedas.cotrans.igrf import set_igrf_params
+import libs.epoch as epoch
+import libs.quaternion as quaternion
 # This is primarily adopted from pyspedas.
 # https://github.com/spedas/pyspedas/blob/master/pyspedas/cotrans/cotrans_lib.py
 # But I plan to clean up the subroutines a bit (e.g., use quaternions, clean up the Sun related routines.)
 
+# Each transform is a stack of rotation matrices, [N,3,3], applied as vec1 = M @ vec0.
+# The matrices of a path are multiplied first, then applied to vectors in one go.
+# The sun direction and the dipole direction are computed once for all steps of a path.
+
+# The max number of records transformed at a time, to limit the memory of matrices.
+chunk_records = 1000000
+
+# Optionally, the matrices are computed on a grid of grid_cadence sec, and interpolated to the times
+# by quaternion slerp. The grid is cached in blocks of grid_block nodes, with the least recently used
+# blocks dropped after max_grid_blocks. None to compute the matrices at every time.
+# The error is the angle between the interpolated and the exact rotations, max over 2014-2015:
+#   grid_cadence      10 s     60 s     300 s    3600 s
+#   gsm, sm (rad)     1.3e-8   4.8e-7   1.2e-5   1.7e-3
+#   others (rad)      <1e-10   <1e-10   <1e-10   1.4e-9
+# The gsm and sm error grows as grid_cadence^2, from the dipole wobbling with the Earth's spin.
+# In addition, the IGRF dipole steps once a day, which gives up to 5e-6 rad for mag, gsm, and sm
+# in the last cell of each day.
+grid_cadence = None
+grid_block = 1440
+max_grid_blocks = 256
+_grid_blocks = OrderedDict()
+
+# RBSP coords. UVW is the spinning frame, whose attitude comes from the q_uvw2gse quaternions
+# in the EFW spice files, which can be sampled slower than the spin, e.g., every minute.
+# The attitude is split into the spin axis w, which is slerped, and the spin phase about w,
+# which is unwrapped with the spin period and interpolated linearly.
+# MGSE has x along the spin axis w, y = -w x z_gse, and z = x x y.
+rbsp_coords = ['rbsp_uvw','rbsp_mgse']
+# The time in sec to load beyond the times, to interpolate at the edges.
+rbsp_q_pad = 60.
+# The spin period in sec, for a right-handed spin about w, and how far off it can be.
+# The phase is unwrapped for gaps between quaternions up to rbsp_spin_period**2/(2*rbsp_spin_period_error).
+rbsp_spin_period = 11.0
+rbsp_spin_period_error = 0.2
+
+
+def time_parts(times):
+    """
+    Break unix times into year, day of year, and fraction of day.
+    """
+    times = np.asarray(times, dtype=float)
+    days = np.floor(times/86400).astype(np.int64)
+    year, month, day = epoch.days_to_civil(days)
+    doy = days-epoch.civil_to_days(year, 1, 1)+1
+    fday = times/86400-days
+    return year, doy, fday
+
+
+def csundir(times, parts=None):
+    """
+    The direction of the sun, same as cotrans_lib.csundir_vect.
+    :param parts: time_parts of times, if known.
+    :return: gst, slong, sra, sdec, obliq, in radian.
+    """
+    iyear, idoy, fday = time_parts(times) if parts is None else parts
+
+    # Julian day and greenwich mean sideral time
+    pisd = np.pi/180.0
+    jj = 365*(iyear-1900)+np.fix((iyear-1901)/4)+idoy
+    dj = jj-0.5+fday
+    gst = np.mod(279.690983+0.9856473354*dj+360.0*fday+180.0, 360.0)*pisd
+
+    # longitude along ecliptic
+    vl = np.mod(279.696678+0.9856473354*dj, 360.0)
+    t = dj/36525.0
+    g = np.mod(358.475845+0.985600267*dj, 360.0)*pisd
+    slong = (vl+(1.91946-0.004789*t)*np.sin(g)+0.020094*np.sin(2.0*g))*pisd
+
+    # inclination of Earth's axis
+    obliq = (23.45229-0.0130125*t)*pisd
+    sob = np.sin(obliq)
+    cob = np.cos(obliq)
+
+    # Aberration due to Earth's motion around the sun (about 0.0056 deg)
+    pre = (0.005686-0.025e-4*t)*pisd
+
+    # declination of the sun
+    slp = slong-pre
+    sind = sob*np.sin(slp)
+    cosd = np.sqrt(1.0-sind**2)
+    sc = sind/cosd
+    sdec = np.arctan(sc)
+
+    # right ascension of the sun
+    sra = np.pi-np.arctan2((cob/sob)*sc, -np.cos(slp)/cosd)
+
+    return gst, slong, sra, sdec, obliq
+
+
+@lru_cache(maxsize=None)
+def _igrf_dipole():
+    # g10, g11, h11 of IGRF for the years in the table, and their secular variations.
+    minyear, maxyear, ga, ha, dg, dh = set_igrf_params()
+    years = np.array(sorted(ga.keys()))
+    g = np.array([[ga[year][1], ga[year][2], ha[year][2]] for year in years])
+    dgh = np.array([dg[1], dg[2], dh[2]])
+    return minyear, years, g, dgh
+
+
+def cdipdir(times, parts=None):
+    """
+    The direction of the dipole in GEO, same as cotrans_lib.cdipdir.
+    The IGRF coefficients are interpolated by day, and extrapolated after
+    the last year in the table.
+    :param parts: time_parts of times, if known.
+    :return: d1, d2, d3.
+    """
+    iyear, idoy, fday = time_parts(times) if parts is None else parts
+    # The direction changes by day, so work on each day once.
+    days, index = np.unique(iyear*1000+idoy, return_inverse=True)
+    d1, d2, d3 = _cdipdir(days//1000, days % 1000)
+    return d1[index], d2[index], d3[index]
+
+
+def _cdipdir(iyear, idoy):
+    minyear, years, g, dgh = _igrf_dipole()
+
+    year0 = np.clip(iyear-(iyear % 5), minyear, years[-1])
+    index = (year0-years[0])//5
+    year = iyear+(idoy-1)/365.25
+    f2 = ((year-year0)/5)[:,None]
+    f3 = (year-years[-1])[:,None]
+    next_index = np.minimum(index+1, len(years)-1)
+    coefs = np.where((year0 < years[-1])[:,None],
+        g[index]*(1-f2)+g[next_index]*f2,
+        g[index]+dgh*f3)
+
+    g10 = -coefs[:,0]
+    g11 = coefs[:,1]
+    h11 = coefs[:,2]
+    sqq = np.sqrt(g11**2+h11**2)
+    sqr = np.sqrt(g10**2+sqq**2)
+    st0 = sqq/sqr
+    return st0*(-g11/sqq), st0*(-h11/sqq), g10/sqr
+
+
+class _geometry:
+    """
+    The sun and dipole directions of times, computed when first needed.
+    """
+    def __init__(self, times, q_uvw2gse=None):
+        self.times = times
+        self.q_uvw2gse = q_uvw2gse
+        self._parts = None
+        self._csundir = None
+        self._cdipdir = None
+        self._sun_gei = None
+        self._uvw2gse = None
+
+    def parts(self):
+        if self._parts is None:
+            self._parts = time_parts(self.times)
+        return self._parts
+
+    def csundir(self):
+        if self._csundir is None:
+            self._csundir = csundir(self.times, self.parts())
+        return self._csundir
+
+    def cdipdir(self):
+        if self._cdipdir is None:
+            self._cdipdir = cdipdir(self.times, self.parts())
+        return self._cdipdir
+
+    def sun_gei(self):
+        # The direction of the sun in GEI.
+        if self._sun_gei is None:
+            gst, slong, sra, sdec, obliq = self.csundir()
+            self._sun_gei = (np.cos(sra)*np.cos(sdec), np.sin(sra)*np.cos(sdec), np.sin(sdec))
+        return self._sun_gei
+
+    def uvw2gse(self):
+        # The rbsp attitude, from the quaternions as (times, q).
+        if self._uvw2gse is None:
+            if self.q_uvw2gse is None: raise Exception('No q_uvw2gse ...')
+            qtimes, q = self.q_uvw2gse
+            self._uvw2gse = rbsp_interp_uvw2gse(qtimes, q, self.times)
+        return self._uvw2gse
+
+
+def _stack(rows):
+    """
+    Stack [[m00,m01,m02],...] of arrays or numbers into [N,3,3].
+    """
+    n = max(np.size(x) for row in rows for x in row)
+    matrix = np.empty((n,3,3))
+    for i, row in enumerate(rows):
+        for j, x in enumerate(row):
+            matrix[:,i,j] = x
+    return matrix
+
+
+def _transpose(matrix):
+    return np.swapaxes(matrix, 1, 2)
+
+
+def gei2gse_matrix(geom):
+    gs1, gs2, gs3 = geom.sun_gei()
+    obliq = geom.csundir()[4]
+    ge1, ge2, ge3 = 0.0, -np.sin(obliq), np.cos(obliq)
+    return _stack([
+        [gs1, gs2, gs3],
+        [ge2*gs3-ge3*gs2, ge3*gs1-ge1*gs3, ge1*gs2-ge2*gs1],
+        [ge1, ge2, ge3],
+    ])
+
+def gse2gsm_matrix(geom):
+    gd1, gd2, gd3 = geom.cdipdir()
+    gs1, gs2, gs3 = geom.sun_gei()
+    gst, slong, sra, sdec, obliq = geom.csundir()
+    sgst, cgst = np.sin(gst), np.cos(gst)
+    ge1, ge2, ge3 = 0.0, -np.sin(obliq), np.cos(obliq)
+
+    # The dipole in GEI.
+    gm1 = gd1*cgst-gd2*sgst
+    gm2 = gd1*sgst+gd2*cgst
+    gm3 = gd3
+    gmgs1 = gm2*gs3-gm3*gs2
+    gmgs2 = gm3*gs1-gm1*gs3
+    gmgs3 = gm1*gs2-gm2*gs1
+    rgmgs = np.sqrt(gmgs1**2+gmgs2**2+gmgs3**2)
+    cdze = (ge1*gm1+ge2*gm2+ge3*gm3)/rgmgs
+    sdze = (ge1*gmgs1+ge2*gmgs2+ge3*gmgs3)/rgmgs
+    return _stack([
+        [1.0, 0.0, 0.0],
+        [0.0, cdze, sdze],
+        [0.0, -sdze, cdze],
+    ])
+
+def gsm2sm_matrix(geom):
+    gd1, gd2, gd3 = geom.cdipdir()
+    gs1, gs2, gs3 = geom.sun_gei()
+    gst = geom.csundir()[0]
+    sgst, cgst = np.sin(gst), np.cos(gst)
+
+    # The sun in GEO, and the dipole tilt angle mu.
+    ps1 = gs1*cgst+gs2*sgst
+    ps2 = -gs1*sgst+gs2*cgst
+    ps3 = gs3
+    smu = ps1*gd1+ps2*gd2+ps3*gd3
+    cmu = np.sqrt(1.0-smu*smu)
+    return _stack([
+        [cmu, 0.0, -smu],
+        [0.0, 1.0, 0.0],
+        [smu, 0.0, cmu],
+    ])
+
+def gei2geo_matrix(geom):
+    gst = geom.csundir()[0]
+    sgst, cgst = np.sin(gst), np.cos(gst)
+    return _stack([
+        [cgst, sgst, 0.0],
+        [-sgst, cgst, 0.0],
+        [0.0, 0.0, 1.0],
+    ])
+
+def geo2mag_matrix(geom):
+    # Rotate about z by the longitude of the dipole, then about y by its colatitude.
+    gd1, gd2, gd3 = geom.cdipdir()
+    phi = np.arctan2(gd2, gd1)
+    colat = np.pi/2-np.arctan2(gd3, np.sqrt(gd1**2+gd2**2))
+    sphi, cphi = np.sin(phi), np.cos(phi)
+    scolat, ccolat = np.sin(colat), np.cos(colat)
+    return _stack([
+        [ccolat*cphi, ccolat*sphi, -scolat],
+        [-sphi, cphi, 0.0],
+        [scolat*cphi, scolat*sphi, ccolat],
+    ])
+
+def gei2j2000_matrix(geom):
+    # cotrans_lib gives [3,3,N], applied as its transpose.
+    return np.transpose(cotrans_lib.j2000_matrix_vec(geom.times), (2,1,0))
+
+def gse2gei_matrix(geom):
+    return _transpose(gei2gse_matrix(geom))
+
+def gsm2gse_matrix(geom):
+    return _transpose(gse2gsm_matrix(geom))
+
+def sm2gsm_matrix(geom):
+    return _transpose(gsm2sm_matrix(geom))
+
+def geo2gei_matrix(geom):
+    return _transpose(gei2geo_matrix(geom))
+
+def mag2geo_matrix(geom):
+    return _transpose(geo2mag_matrix(geom))
+
+def j20002gei_matrix(geom):
+    return _transpose(gei2j2000_matrix(geom))
+
+
+def rbsp_uvw2gse_matrix(geom):
+    return geom.uvw2gse()
+
+def gse2rbsp_uvw_matrix(geom):
+    return _transpose(geom.uvw2gse())
+
+def _mgse_axes(w):
+    # The y and z axes of MGSE in GSE, for the spin axis w in GSE.
+    y = -np.cross(w, [0.0,0.0,1.0])
+    y /= np.linalg.norm(y, axis=1)[:,np.newaxis]
+    return y, np.cross(w, y)
+
+def gse2rbsp_mgse_matrix(geom):
+    # The spin axis w in GSE.
+    w = geom.uvw2gse()[:,:,2]
+    y, z = _mgse_axes(w)
+    return np.stack([w, y, z], axis=1)
+
+def rbsp_mgse2gse_matrix(geom):
+    return _transpose(gse2rbsp_mgse_matrix(geom))
+
+
+def find_path(input, output):
+    """
+    Return the coords from input to output, e.g., ['gse','gei','geo'].
+    RBSP coords go through gse.
+    """
+    head = [input] if input in rbsp_coords else []
+    tail = [output] if output in rbsp_coords else []
+    if head: input = 'gse'
+    if tail: output = 'gse'
+    if input == output:
+        p = [input]
+    else:
+        p = cotrans_lib.find_path_t1_t2(input, output)
+        p = cotrans_lib.shorten_path_t1_t2(p)
+        p = cotrans_lib.shorten_path_t1_t2(p)
+    return head+p+tail
+
+
+def rbsp_q_uvw2gse(time_range, probe):
+    """
+    Load the q_uvw2gse quaternions of a probe for a time range in unix time.
+    :return: times in [n], and quaternions in [n,4] as (w,x,y,z).
+    """
+    # Not imported at the top, because libs do not depend on data loading otherwise.
+    import read.rbsp
+    import system.manager as smg
+
+    if probe is None: raise Exception('No probe for rbsp coords ...')
+    time_range = [time_range[0]-rbsp_q_pad, time_range[1]+rbsp_q_pad]
+    q_var = read.rbsp.q_uvw2gse(time_range, probe, get_name=True)
+    read.rbsp.q_uvw2gse(time_range, probe)
+    if not smg.has_var(q_var) or smg.get_time_var(q_var) is None or len(smg.get_time(q_var)) == 0:
+        raise Exception(f'No q_uvw2gse for rbsp{probe} ...')
+    qtimes = smg.get_time(q_var)
+    q = quaternion.normalize(np.asarray(smg.get_data(q_var), dtype=float))
+    return qtimes, q
+
+
+def rbsp_interp_uvw2gse(qtimes, q, times):
+    """
+    Interpolate the uvw2gse attitude from quaternions to times, following the spin between them.
+    :param qtimes: the times of the quaternions in [n], sorted.
+    :param q: the quaternions in [n,4].
+    :param times: the times in [N], within qtimes.
+    :return: the rotation matrices in [N,3,3].
+    """
+    qtimes = np.asarray(qtimes, dtype=float)
+    times = np.asarray(times, dtype=float)
+    if len(qtimes) < 2:
+        raise Exception('Need at least 2 q_uvw2gse to interpolate ...')
+    if times.min() < qtimes[0] or times.max() > qtimes[-1]:
+        raise Exception('Times are out of the range of q_uvw2gse ...')
+
+    # Split the attitude into the despun frame (MGSE y, MGSE z, w) and the spin phase of u in it.
+    matrix = quaternion.to_matrix(q)
+    u, w = matrix[:,:,0], matrix[:,:,2]
+    y, z = _mgse_axes(w)
+    despun = np.stack([y, z, w], axis=2)
+    phase = np.arctan2(np.sum(u*z, axis=1), np.sum(u*y, axis=1))
+
+    # The measured phase steps are modulo 2pi, add the whole turns expected from the spin period.
+    index = np.clip(np.searchsorted(qtimes, times, side='right')-1, 0, len(qtimes)-2)
+    dt = np.diff(qtimes)
+    max_gap = rbsp_spin_period**2/(2*rbsp_spin_period_error)
+    if np.max(dt[np.unique(index)]) > max_gap:
+        raise Exception(f'q_uvw2gse has gaps over {max_gap:.0f} sec, cannot follow the spin ...')
+    dphase = np.angle(np.exp(1j*np.diff(phase)))
+    # Steps much shorter than a spin show the spin direction.
+    short = dt < rbsp_spin_period/4
+    if np.any(short) and np.median(dphase[short]) < 0:
+        raise Exception('q_uvw2gse spins against rbsp_spin_period ...')
+    dphase += 2*np.pi*np.round((2*np.pi*dt/rbsp_spin_period-dphase)/(2*np.pi))
+    phase = phase[0]+np.concatenate([[0.0], np.cumsum(dphase)])
+
+    f = (times-qtimes[index])/dt[index]
+    the_phase = phase[index]+f*(phase[index+1]-phase[index])
+    cos, sin = np.cos(the_phase), np.sin(the_phase)
+    spin = _stack([[cos,-sin,0.0],[sin,cos,0.0],[0.0,0.0,1.0]])
+    the_despun = quaternion.to_matrix(quaternion.interp(qtimes, quaternion.from_matrix(despun), times))
+    return the_despun @ spin
+
+
+def cotran_matrix(time, input='', output='', probe=None, q_uvw2gse=None):
+    """
+    Return the rotation matrices from input to output coord, in [N,3,3].
+    :param q_uvw2gse: the rbsp quaternions as (times, q). Loaded for the probe if needed and not set.
+    """
+    times = np.atleast_1d(np.asarray(time, dtype=float))
+    if q_uvw2gse is None and (input in rbsp_coords or output in rbsp_coords):
+        q_uvw2gse = rbsp_q_uvw2gse([times.min(), times.max()], probe)
+    geom = _geometry(times, q_uvw2gse=q_uvw2gse)
+    p = find_path(input, output)
+    matrix = None
+    for i in range(len(p)-1):
+        routine_name = p[i]+'2'+p[i+1]+'_matrix'
+        the_matrix = globals()[routine_name](geom)
+        matrix = the_matrix if matrix is None else the_matrix @ matrix
+    return matrix
+
+
+def grid_quaternions(block, cadence, input, output, probe=None):
+    """
+    Return the quaternions from input to output coord on a block of the grid, in [grid_block+1,4].
+    The block covers times from block*grid_block*cadence, with one more node at the end.
+    """
+    key = (input, output, probe, float(cadence), int(block))
+    quats = _grid_blocks.get(key, None)
+    if quats is not None:
+        _grid_blocks.move_to_end(key)
+        return quats
+
+    times = (block*grid_block+np.arange(grid_block+1))*cadence
+    quats = quaternion.from_matrix(cotran_matrix(times, input, output, probe=probe))
+    _grid_blocks[key] = quats
+    while len(_grid_blocks) > max_grid_blocks:
+        _grid_blocks.popitem(last=False)
+    return quats
+
+
+def grid_cotran_matrix(time, input='', output='', cadence=60., probe=None):
+    """
+    Same as cotran_matrix, but interpolated from a grid of the given cadence in sec.
+    See grid_cadence for the accuracy.
+    """
+    times = np.atleast_1d(np.asarray(time, dtype=float))
+    nodes = times/cadence
+    index = np.floor(nodes).astype(np.int64)
+    blocks = index//grid_block
+    the_blocks, block_index = np.unique(blocks, return_inverse=True)
+    quats = np.concatenate([grid_quaternions(block, cadence, input, output, probe=probe)
+        for block in the_blocks])
+    index = block_index*(grid_block+1)+index-blocks*grid_block
+    return quaternion.to_matrix(quaternion.slerp(quats[index], quats[index+1], nodes-np.floor(nodes)))
 
 
 def cotran(
@@ -11,7 +464,14 @@ def cotran(
     input='',
     output='',
     probe=None,
+    cadence=None,
 ):
+    """
+    Transform vectors in [N,3] from input to output coord.
+    :param cadence: a number in sec to interpolate the matrices from a grid of the cadence.
+        By default, grid_cadence is used. Not used for rbsp coords, which spin.
+    :param probe: 'a' or 'b' for rbsp coords.
+    """
     supported_coords = ['gse','gsm','sm','gei','geo','mag','j2000','rbsp_uvw','rbsp_mgse']
 
     if input not in supported_coords:
@@ -20,62 +480,77 @@ def cotran(
         raise Exception(f'Unknown output coord {input} ...')
     if input == output:
         return vec0
-    
-    p = cotrans_lib.find_path_t1_t2(input, output)
-    p = cotrans_lib.shorten_path_t1_t2(p)
-    p = cotrans_lib.shorten_path_t1_t2(p)
 
-    vec1 = vec0
-    for i in range(len(p)-1):
-        routine_name = p[i]+'2'+p[i+1]
-        vec1 = globals()[routine_name](vec1, time, probe=probe)
+    vec0 = np.asarray(vec0, dtype=float)
+    times = np.asarray(time, dtype=float)
+    if cadence is None:
+        cadence = grid_cadence
+    # The quaternions are loaded once for all chunks.
+    q_uvw2gse = None
+    if input in rbsp_coords or output in rbsp_coords:
+        q_uvw2gse = rbsp_q_uvw2gse([times.min(), times.max()], probe)
+        cadence = None
+    vec1 = np.empty(vec0.shape)
+    for i in range(0, len(times), chunk_records):
+        j = min(i+chunk_records, len(times))
+        if cadence is None:
+            matrix = cotran_matrix(times[i:j], input, output, probe=probe, q_uvw2gse=q_uvw2gse)
+        else:
+            matrix = grid_cotran_matrix(times[i:j], input, output, cadence=cadence, probe=probe)
+        vec1[i:j] = np.einsum('nij,nj->ni', matrix, vec0[i:j])
     return vec1
 
 
 def rbsp_uvw2gse(vec0, uts, probe=None):
-    pass
+    return cotran(vec0, uts, 'rbsp_uvw', 'gse', probe=probe)
 
 def rbsp_gse2uvw(vec0, uts, probe=None):
-    pass
+    return cotran(vec0, uts, 'gse', 'rbsp_uvw', probe=probe)
 
 def rbsp_mgse2gse(vec0, uts, probe=None):
-    pass
+    return cotran(vec0, uts, 'rbsp_mgse', 'gse', probe=probe)
 
 def rbsp_mgse2uvw(vec0, uts, probe=None):
-    pass
+    return cotran(vec0, uts, 'rbsp_mgse', 'rbsp_uvw', probe=probe)
+
+
+def _rotate(routine_name, vec0, uts):
+    geom = _geometry(np.atleast_1d(np.asarray(uts, dtype=float)))
+    matrix = globals()[routine_name+'_matrix'](geom)
+    return np.einsum('nij,nj->ni', matrix, np.asarray(vec0, dtype=float))
 
 def gei2gse(vec0, uts, probe=None):
-    return cotrans_lib.subgei2gse(uts, vec0)
+    return _rotate('gei2gse', vec0, uts)
 
 def gse2gei(vec0, uts, probe=None):
-    return cotrans_lib.subgse2gei(uts, vec0)
+    return _rotate('gse2gei', vec0, uts)
 
 def gse2gsm(vec0, uts, probe=None):
-    return cotrans_lib.subgse2gsm(uts, vec0)
+    return _rotate('gse2gsm', vec0, uts)
 
 def gsm2gse(vec0, uts, probe=None):
-    return cotrans_lib.subgsm2gse(uts, vec0)
+    return _rotate('gsm2gse', vec0, uts)
 
 def gsm2sm(vec0, uts, probe=None):
-    return cotrans_lib.subgsm2sm(uts, vec0)
+    return _rotate('gsm2sm', vec0, uts)
 
 def sm2gsm(vec0, uts, probe=None):
-    return cotrans_lib.subsm2gsm(uts, vec0)
+    return _rotate('sm2gsm', vec0, uts)
 
 def gei2geo(vec0, uts, probe=None):
-    return cotrans_lib.subgei2geo(uts, vec0)
+    return _rotate('gei2geo', vec0, uts)
 
 def geo2gei(vec0, uts, probe=None):
-    return cotrans_lib.subgeo2gei(uts, vec0)
+    return _rotate('geo2gei', vec0, uts)
 
 def geo2mag(vec0, uts, probe=None):
-    return cotrans_lib.subgeo2mag(uts, vec0)
+    return _rotate('geo2mag', vec0, uts)
 
 def mag2geo(vec0, uts, probe=None):
-    return cotrans_lib.submag2geo(uts, vec0)
+    return _rotate('mag2geo', vec0, uts)
 
 def gei2j2000(vec0, uts, probe=None):
-    return cotrans_lib.subgei2j2000(uts, vec0)
+    return _rotate('gei2j2000', vec0, uts)
 
 def j20002gei(vec0, uts, probe=None):
-    return cotrans_lib.subj20002gei(uts, vec0)
\ No newline at end of file
+    return _rotate('j20002gei', vec0, uts)
@@ -1,3 +1,8 @@
+import os
+import calendar
+import datetime
+from functools import lru_cache
+import numpy as np
 from astropy.time import Time
 from astropy.time.formats import TimeFromEpoch, erfa
 from pyspedas.utilities.time_string import time_string
@@ -8,6 +13,437 @@ from pyspedas.utilities.time_double import time_double
 # https://github.com/MAVENSDC/PyTplot/blob/master/pytplot/importers/cdf_to_tplot.py
 # https://github.com/MAVENSDC/cdflib/blob/master/cdflib/epochs_astropy.py 
 
+# Unix time of 0000-01-01, the zero of CDF_EPOCH and CDF_EPOCH16.
+epoch_offset = 62167219200
+# Unix time in ns of the zero of CDF_TIME_TT2000, i.e., 2000-01-01T12:00 TT
+# or 11:58:55.816 UTC when TAI-UTC was 32 sec.
+tt2000_offset = 946727935816000000
+tt2000_fillval = np.iinfo(np.int64).min
+# Unix time of 1968-05-24, the zero of SDT time.
+sdt_offset = -50716800
+
+# The unix time when TAI-UTC changes, and the new TAI-UTC in sec.
+# Before 1972, TAI-UTC drifts as a+(mjd-mjd0)*drift, where mjd is the
+# modified julian day at noon. The table is the one of the CDF library.
+# https://hpiers.obspm.fr/iers/bul/bulc/Leap_Second.dat
+_builtin_leap_seconds = np.array([
+    # unix time, a, mjd0, drift.
+    [-315619200,  1.4178180, 37300., 0.0012960],
+    [-283996800,  1.4228180, 37300., 0.0012960],
+    [-265680000,  1.3728180, 37300., 0.0012960],
+    [-252460800,  1.8458580, 37665., 0.0011232],
+    [-194659200,  1.9458580, 37665., 0.0011232],
+    [-189388800,  3.2401300, 38761., 0.0012960],
+    [-181526400,  3.3401300, 38761., 0.0012960],
+    [-168307200,  3.4401300, 38761., 0.0012960],
+    [-157766400,  3.5401300, 38761., 0.0012960],
+    [-152668800,  3.6401300, 38761., 0.0012960],
+    [-142128000,  3.7401300, 38761., 0.0012960],
+    [-136771200,  3.8401300, 38761., 0.0012960],
+    [-126230400,  4.3131700, 39126., 0.0025920],
+    [ -60480000,  4.2131700, 39126., 0.0025920],
+    [  63072000, 10, 0, 0], [  78796800, 11, 0, 0], [  94694400, 12, 0, 0],
+    [ 126230400, 13, 0, 0], [ 157766400, 14, 0, 0], [ 189302400, 15, 0, 0],
+    [ 220924800, 16, 0, 0], [ 252460800, 17, 0, 0], [ 283996800, 18, 0, 0],
+    [ 315532800, 19, 0, 0], [ 362793600, 20, 0, 0], [ 394329600, 21, 0, 0],
+    [ 425865600, 22, 0, 0], [ 489024000, 23, 0, 0], [ 567993600, 24, 0, 0],
+    [ 631152000, 25, 0, 0], [ 662688000, 26, 0, 0], [ 709948800, 27, 0, 0],
+    [ 741484800, 28, 0, 0], [ 773020800, 29, 0, 0], [ 820454400, 30, 0, 0],
+    [ 867715200, 31, 0, 0], [ 915148800, 32, 0, 0], [1136073600, 33, 0, 0],
+    [1230768000, 34, 0, 0], [1341100800, 35, 0, 0], [1435708800, 36, 0, 0],
+    [1483228800, 37, 0, 0],
+])
+# Unix time of 1858-11-17, i.e., mjd 0, in days.
+_mjd_unix = -40587
+
+
+def read_leap_seconds(file):
+    """
+    Read a leap second table in the format of the CDF library, i.e., lines
+    of year, month, day, TAI-UTC, mjd0, drift. Lines starting with ; are comments.
+    :return: an array of [unix time, TAI-UTC, mjd0, drift].
+    """
+    table = list()
+    with open(file) as f:
+        for line in f:
+            cols = line.split()
+            if len(cols) < 6 or cols[0].startswith(';'): continue
+            unix = calendar.timegm((int(cols[0]),int(cols[1]),int(cols[2]),0,0,0))
+            table.append([unix]+[float(col) for col in cols[3:6]])
+    return np.array(table)
+
+
+@lru_cache(maxsize=None)
+def load_leap_seconds(file=None):
+    """
+    Return the leap second table and when each row starts in TT2000.
+    The table is read from file, or $CDF_LEAPSECONDSTABLE as the CDF library
+    does, or the built-in one. It is computed once for each file.
+    """
+    if file is None:
+        file = os.environ.get('CDF_LEAPSECONDSTABLE', None)
+    table = _builtin_leap_seconds
+    if file is not None and os.path.exists(file):
+        table = read_leap_seconds(file)
+
+    # The first TT2000 value with the new TAI-UTC.
+    index = np.arange(len(table))
+    table_tt2000 = (table[:,0]+_leap_seconds(table[:,0], index, table)-32)*1e9-tt2000_offset
+    table_tt2000 = np.round(table_tt2000).astype(np.int64)
+    return table, table_tt2000
+
+
+def _leap_seconds(unix, index, table):
+    """
+    TAI-UTC in sec for unix times, in rows index of the leap second table.
+    """
+    a, mjd0, drift = table[index,1], table[index,2], table[index,3]
+    mjd = np.floor(unix/86400)-_mjd_unix+0.5
+    return np.where(index < 0, 0, a+(mjd-mjd0)*drift)
+
+
+def epoch_to_unix(times):
+    """
+    CDF_EPOCH, i.e., msec since 0000-01-01, to unix time.
+    """
+    return np.asarray(times, dtype=np.float64)*1e-3-epoch_offset
+
+
+def unix_to_epoch(times):
+    return (np.asarray(times, dtype=np.float64)+epoch_offset)*1e3
+
+
+def epoch16_to_unix(times):
+    """
+    CDF_EPOCH16, as complex sec+1j*psec since 0000-01-01 or as pairs of
+    [sec,psec] in the last dimension, to unix time.
+    """
+    times = np.asarray(times)
+    if np.iscomplexobj(times):
+        sec, psec = times.real, times.imag
+    else:
+        sec, psec = times[...,0], times[...,1]
+    return (sec-epoch_offset)+psec*1e-12
+
+
+def unix_to_epoch16(times):
+    """
+    Unix time to CDF_EPOCH16, as complex sec+1j*psec.
+    """
+    times = np.asarray(times, dtype=np.float64)
+    sec = np.floor(times)
+    return (sec+epoch_offset)+1j*np.round((times-sec)*1e12)
+
+
+def tt2000_to_unix(times):
+    """
+    CDF_TIME_TT2000, i.e., nsec since 2000-01-01T12:00 TT, to unix time.
+    Unix time does not count leap seconds, so a leap second maps to the
+    second after it. Fill values are returned as NaN.
+    """
+    table, table_tt2000 = load_leap_seconds()
+    times = np.asarray(times, dtype=np.int64)
+    shape = times.shape
+    times = times.ravel()
+    index = np.searchsorted(table_tt2000, times, side='right')-1
+    # Keep integer ns until the last step to keep the precision.
+    leap = np.round(table[index,1]*1e9).astype(np.int64)
+    unix = ((times+tt2000_offset)-(leap-32000000000))*1e-9
+    # Before 1972, TAI-UTC depends on the day of the UTC time itself.
+    old = np.flatnonzero(table[index,3] != 0)
+    old = np.union1d(old, np.flatnonzero(index < 0))
+    if len(old) > 0:
+        the_times = (times[old]+tt2000_offset)*1e-9+32
+        the_unix = the_times-_leap_seconds(the_times, index[old], table)
+        for i in range(2):
+            the_unix = the_times-_leap_seconds(the_unix, index[old], table)
+        unix[old] = the_unix
+    unix[times == tt2000_fillval] = np.nan
+    return unix.reshape(shape)
+
+
+def unix_to_tt2000(times):
+    """
+    Unix time to CDF_TIME_TT2000. NaN is returned as the fill value.
+    """
+    table, table_tt2000 = load_leap_seconds()
+    times = np.asarray(times, dtype=np.float64)
+    shape = times.shape
+    times = times.ravel()
+    valid = np.isfinite(times)
+    times = np.where(valid, times, 0)
+    index = np.searchsorted(table[:,0], times, side='right')-1
+    leap = _leap_seconds(times, index, table)
+    # Split whole seconds to keep the precision of ns.
+    sec = np.floor(times)
+    tt2000 = sec.astype(np.int64)*1000000000+np.round((times-sec+leap-32)*1e9).astype(np.int64)-tt2000_offset
+    tt2000[~valid] = tt2000_fillval
+    return tt2000.reshape(shape)
+
+
+def sdt_to_unix(times):
+    """
+    SDT time, i.e., sec since 1968-05-24, to unix time.
+    """
+    return np.asarray(times, dtype=np.float64)+sdt_offset
+
+
+def unix_to_sdt(times):
+    return np.asarray(times, dtype=np.float64)-sdt_offset
+
+
+def unix_to_unix(times):
+    return np.asarray(times, dtype=np.float64)
+
+
+def days_to_civil(days):
+    """
+    Days since 1970-01-01 to year, month, and day, in integer arithmetic.
+    http://howardhinnant.github.io/date_algorithms.html
+    """
+    days = np.asarray(days, dtype=np.int64)+719468
+    era = days//146097
+    doe = days-era*146097
+    yoe = (doe-doe//1460+doe//36524-doe//146096)//365
+    doy = doe-(365*yoe+yoe//4-yoe//100)
+    mp = (5*doy+2)//153
+    day = doy-(153*mp+2)//5+1
+    month = np.where(mp < 10, mp+3, mp-9)
+    year = yoe+era*400+(month <= 2)
+    return year, month, day
+
+
+def civil_to_days(year, month, day):
+    """
+    Year, month, and day to days since 1970-01-01, in integer arithmetic.
+    """
+    year = np.asarray(year, dtype=np.int64)
+    month = np.asarray(month, dtype=np.int64)
+    day = np.asarray(day, dtype=np.int64)
+    year = year-(month <= 2)
+    era = year//400
+    yoe = year-era*400
+    doy = (153*np.where(month > 2, month-3, month+9)+2)//5+day-1
+    doe = yoe*365+yoe//4-yoe//100+doy
+    return era*146097+doe-719468
+
+
+# The strftime directives that are done in integer arithmetic, and their widths.
+_pattern_widths = {
+    'Y': 4, 'y': 2, 'm': 2, 'd': 2, 'j': 3,
+    'H': 2, 'M': 2, 'S': 2, 'f': 6,
+}
+
+
+@lru_cache(maxsize=256)
+def compile_pattern(pattern):
+    """
+    Break a strftime pattern into literal bytes and fixed-width fields.
+    :return: a tuple of (directive, offset, width), with directive '' for
+        literals, and the total width. Or None if the pattern has other
+        directives or non-ascii characters.
+    """
+    if not pattern.isascii(): return None
+    tokens = list()
+    literal = ''
+    offset = 0
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char != '%':
+            literal += char
+            i += 1
+            continue
+        if i+1 == len(pattern): return None
+        directive = pattern[i+1]
+        i += 2
+        if directive == '%':
+            literal += '%'
+            continue
+        if directive not in _pattern_widths: return None
+        if literal != '':
+            tokens.append(('', offset, literal.encode('ascii')))
+            offset += len(tokens[-1][2])
+            literal = ''
+        width = _pattern_widths[directive]
+        tokens.append((directive, offset, width))
+        offset += width
+    if literal != '':
+        tokens.append(('', offset, literal.encode('ascii')))
+        offset += len(tokens[-1][2])
+    return tuple(tokens), offset
+
+
+def format_time(times, pattern):
+    """
+    Format unix times with a strftime pattern. Patterns of %Y, %y, %m, %d,
+    %j, %H, %M, %S, %f are compiled once and done for whole arrays,
+    others are passed to datetime.strftime.
+    :return: a str for a scalar, or a list of str.
+    """
+    compiled = compile_pattern(pattern)
+    if compiled is None:
+        return unix_to_string(times, pattern)
+    tokens, width = compiled
+
+    times = np.asarray(times, dtype=np.float64)
+    usecs = np.round(times.ravel()*1e6).astype(np.int64)
+    secs = usecs//1000000
+    days = secs//86400
+    secofday = secs-days*86400
+    year, month, day = days_to_civil(days)
+    fields = {
+        'Y': year, 'y': year % 100, 'm': month, 'd': day,
+        'j': days-civil_to_days(year, 1, 1)+1,
+        'H': secofday//3600, 'M': (secofday//60) % 60, 'S': secofday % 60,
+        'f': usecs-secs*1000000,
+    }
+
+    # Fill in a matrix of chars, one row per time.
+    chars = np.empty((len(usecs),width), dtype=np.uint8)
+    for directive, offset, value in tokens:
+        if directive == '':
+            chars[:,offset:offset+len(value)] = np.frombuffer(value, dtype=np.uint8)
+            continue
+        field = fields[directive]
+        for i in range(value):
+            chars[:,offset+value-1-i] = field//10**i % 10+48
+    strs = chars.view(f'S{width}').ravel().astype(str).tolist()
+
+    if times.ndim == 0: return strs[0]
+    return strs
+
+
+def parse_time(strs, pattern):
+    """
+    Parse strings of a strftime pattern to unix times. Compiled patterns
+    read fixed-width fields as in format_time, missing fields are taken
+    from 1900-01-01 as in datetime.strptime. Others are passed to it.
+    """
+    compiled = compile_pattern(pattern)
+    is_scalar = isinstance(strs, str)
+    strs = np.atleast_1d(np.asarray(strs, dtype=str))
+    if compiled is None or strs.dtype.itemsize//4 != compiled[1]:
+        unix = _strptime(strs, pattern)
+        if is_scalar: return unix[0]
+        return unix
+    tokens, width = compiled
+
+    try:
+        chars = np.frombuffer(np.char.encode(strs.ravel(), 'ascii').tobytes(),
+            dtype=np.uint8).reshape(-1,width)
+    except UnicodeEncodeError:
+        chars = None
+    fields = dict()
+    if chars is not None:
+        for directive, offset, value in tokens:
+            if directive == '':
+                if not np.all(chars[:,offset:offset+len(value)] == np.frombuffer(value, dtype=np.uint8)):
+                    chars = None
+                    break
+                continue
+            digits = chars[:,offset:offset+value].astype(np.int64)-48
+            if np.any((digits < 0) | (digits > 9)):
+                chars = None
+                break
+            fields[directive] = digits @ 10**np.arange(value-1,-1,-1)
+    # Leave strings of variable widths and errors to strptime.
+    if chars is None:
+        unix = _strptime(strs, pattern)
+        if is_scalar: return unix[0]
+        return unix
+
+    n = chars.shape[0]
+    if 'Y' in fields:
+        year = fields['Y']
+    elif 'y' in fields:
+        year = fields['y']+np.where(fields['y'] < 69, 2000, 1900)
+    else:
+        year = np.full(n, 1900)
+    if 'j' in fields:
+        days = civil_to_days(year, 1, 1)+fields['j']-1
+    else:
+        days = civil_to_days(year, fields.get('m', 1), fields.get('d', 1))
+    secs = days*86400+fields.get('H', 0)*3600+fields.get('M', 0)*60+fields.get('S', 0)
+    unix = secs+fields.get('f', 0)*1e-6
+    unix = np.asarray(unix, dtype=np.float64).reshape(strs.shape)
+    if is_scalar: return unix[0]
+    return unix
+
+
+def _strptime(strs, pattern):
+    dts = np.array([datetime.datetime.strptime(str(s), pattern) for s in strs.ravel()],
+        dtype='datetime64[ns]').reshape(strs.shape)
+    return dts.astype(np.int64)*1e-9
+
+
+def unix_to_string(times, pattern):
+    """
+    Format unix times with datetime.strftime. See format_time.
+    """
+    times = np.asarray(times, dtype=np.float64)
+    dts = np.round(times.ravel()*1e6).astype(np.int64).astype('datetime64[us]').astype(object)
+    strs = [dt.strftime(pattern) for dt in dts]
+    if times.ndim == 0: return strs[0]
+    return strs
+
+
+def string_to_unix(times, pattern=None):
+    """
+    Parse strings to unix times, with a strftime pattern, or as ISO times
+    when pattern is None. Other strings are left to pyspedas.time_double.
+    """
+    if pattern is not None:
+        return parse_time(times, pattern)
+    is_scalar = isinstance(times, str)
+    strs = np.atleast_1d(np.asarray(times, dtype=str))
+    try:
+        # pyspedas uses / between date and time.
+        dts = np.asarray(np.char.replace(strs, '/', 'T'), dtype='datetime64[ns]')
+    except ValueError:
+        return time_double(times)
+    unix = dts.astype(np.int64)*1e-9
+    if is_scalar: return unix[0]
+    return unix
+
+
+_time_formats = {
+    'unix': 'unix',
+    'cdf_double': 'unix',
+    'epoch': 'epoch',
+    'cdf_epoch': 'epoch',
+    'epoch16': 'epoch16',
+    'cdf_epoch16': 'epoch16',
+    'tt2000': 'tt2000',
+    'cdf_tt2000': 'tt2000',
+    'cdf_time_tt2000': 'tt2000',
+    'sdt': 'sdt',
+    'sdt_unix': 'sdt',
+}
+
+# Formats that have a numpy conversion from and to unix time.
+_to_unix = {
+    'unix': unix_to_unix,
+    'epoch': epoch_to_unix,
+    'epoch16': epoch16_to_unix,
+    'tt2000': tt2000_to_unix,
+    'sdt': sdt_to_unix,
+}
+_from_unix = {
+    'unix': unix_to_unix,
+    'epoch': unix_to_epoch,
+    'epoch16': unix_to_epoch16,
+    'tt2000': unix_to_tt2000,
+    'sdt': unix_to_sdt,
+}
+
+
+def _is_string(times):
+    if isinstance(times, str): return True
+    times = np.asarray(times)
+    return times.dtype.kind in 'US' or (times.dtype.kind == 'O' and times.size > 0 and isinstance(times.flat[0], str))
+
+
 class SDT(TimeFromEpoch):
     name = 'sdt_unix'
     unit = 1.0 / (erfa.DAYSEC)  # Seconds
@@ -28,6 +464,8 @@ def to_time(times, message):
     if msg == 'time': return times
     if msg in ['epoch','epoch16','tt2000']:
         msg = 'cdf_'+msg
+    elif msg == 'cdf_time_tt2000':
+        msg = 'cdf_tt2000'
     elif msg == 'cdf_double':
         msg = 'unix'
     elif msg == 'sdt':
@@ -48,6 +486,8 @@ def from_time(times, message):
     if msg == 'time': return times
     if msg in ['epoch','epoch16','tt2000']:
         msg = 'cdf_'+msg
+    elif msg == 'cdf_time_tt2000':
+        msg = 'cdf_tt2000'
     elif msg == 'cdf_double':
         msg = 'unix'
     elif msg == 'sdt':
@@ -63,14 +503,46 @@ def from_time(times, message):
 
     
 
+def to_unix(times, message):
+    """
+    Convert times in a format to unix time. See convert_time.
+    """
+    msg = message.lower()
+    msg = _time_formats.get(msg, msg)
+    if msg in _to_unix:
+        return _to_unix[msg](times)
+    if '%' in message:
+        return string_to_unix(times, message)
+    if _is_string(times):
+        return string_to_unix(times)
+    return from_time(to_time(times, message), 'unix')
+
+
+def from_unix(times, message):
+    """
+    Convert unix time to a format. See convert_time.
+    """
+    msg = message.lower()
+    msg = _time_formats.get(msg, msg)
+    if msg in _from_unix:
+        return _from_unix[msg](times)
+    if '%' in message:
+        return format_time(times, message)
+    return from_time(Time(times, format='unix'), message)
+
+
 def convert_time(
     times=None,
     input=None,
     output=None,
 ):
+    """
+    Convert times between formats, through unix time.
+    'unix' (or 'cdf_double'), 'epoch', 'epoch16', 'tt2000' (or their CDF
+    types), and 'sdt' are converted with numpy. A format with % is a
+    strftime pattern. 'time' and other formats of astropy.time.Time go
+    through astropy.
+    """
     if times is None: return None
 
-    try:
-        return from_time(to_time(times, input), output)
-    except:
-        return from_time(to_time(list(times), input), output)
\ No newline at end of file
+    return from_unix(to_unix(times, input), output)
@@ -0,0 +1,87 @@
+import numpy as np
+
+# Quaternions are in [n,4] as (w,x,y,z), for rotations applied as vec1 = M @ vec0.
+
+def normalize(q):
+    return q/np.sqrt(np.sum(q*q, axis=-1))[:,np.newaxis]
+
+def from_matrix(matrix):
+    """
+    matrix are rotation matrices in [n,3,3].
+    return [n,4].
+    """
+    m = np.asarray(matrix, dtype=float)
+    n = len(m)
+    diag = np.stack([m[:,0,0], m[:,1,1], m[:,2,2]], axis=1)
+    trace = np.sum(diag, axis=1)
+    # Use the largest of w,x,y,z to avoid dividing by a small number.
+    choice = np.argmax(np.column_stack([diag, trace]), axis=1)
+
+    q = np.empty((n,4))
+    for i in range(3):
+        j, k = (i+1) % 3, (i+2) % 3
+        index = choice == i
+        mi = m[index]
+        q[index,i+1] = 1-trace[index]+2*mi[:,i,i]
+        q[index,j+1] = mi[:,j,i]+mi[:,i,j]
+        q[index,k+1] = mi[:,k,i]+mi[:,i,k]
+        q[index,0] = mi[:,k,j]-mi[:,j,k]
+    index = choice == 3
+    mi = m[index]
+    q[index,0] = 1+trace[index]
+    q[index,1] = mi[:,2,1]-mi[:,1,2]
+    q[index,2] = mi[:,0,2]-mi[:,2,0]
+    q[index,3] = mi[:,1,0]-mi[:,0,1]
+    return normalize(q)
+
+def to_matrix(q):
+    """
+    q are quaternions in [n,4].
+    return [n,3,3].
+    """
+    w, x, y, z = np.asarray(q, dtype=float).T
+    matrix = np.empty((len(w),3,3))
+    matrix[:,0,0] = 1-2*(y*y+z*z)
+    matrix[:,0,1] = 2*(x*y-z*w)
+    matrix[:,0,2] = 2*(x*z+y*w)
+    matrix[:,1,0] = 2*(x*y+z*w)
+    matrix[:,1,1] = 1-2*(x*x+z*z)
+    matrix[:,1,2] = 2*(y*z-x*w)
+    matrix[:,2,0] = 2*(x*z-y*w)
+    matrix[:,2,1] = 2*(y*z+x*w)
+    matrix[:,2,2] = 1-2*(x*x+y*y)
+    return matrix
+
+def slerp(q0, q1, f):
+    """
+    Spherical linear interpolation from q0 to q1, both in [n,4], at fractions f in [n].
+    return [n,4].
+    """
+    q0 = np.asarray(q0, dtype=float)
+    q1 = np.asarray(q1, dtype=float)
+    f = np.asarray(f, dtype=float)[:,np.newaxis]
+    cos = np.sum(q0*q1, axis=-1)
+    # q and -q are the same rotation, take the shorter arc.
+    q1 = np.where((cos < 0)[:,np.newaxis], -q1, q1)
+    cos = np.abs(cos)[:,np.newaxis]
+    theta = np.arccos(np.minimum(cos, 1.0))
+    sin = np.sin(theta)
+    # Fall back to linear interpolation when the two are too close.
+    small = sin < 1e-10
+    sin = np.where(small, 1.0, sin)
+    w0 = np.where(small, 1-f, np.sin((1-f)*theta)/sin)
+    w1 = np.where(small, f, np.sin(f*theta)/sin)
+    return normalize(w0*q0+w1*q1)
+
+def interp(times, q, new_times):
+    """
+    Slerp quaternions q in [n,4] at sorted times in [n] to new_times in [m].
+    Values outside times are the first or last quaternion.
+    return [m,4].
+    """
+    times = np.asarray(times, dtype=float)
+    new_times = np.asarray(new_times, dtype=float)
+    index = np.clip(np.searchsorted(times, new_times, side='right')-1, 0, len(times)-2)
+    t0, t1 = times[index], times[index+1]
+    f = np.clip((new_times-t0)/(t1-t0), 0, 1)
+    return slerp(q[index], q[index+1], f)
@@ -1,8 +1,15 @@
 import sys
 import os
+import re
+import json
+import time
 import socket
 import getpass
-from pyspedas.utilities.download import download
+import fnmatch
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, urljoin, unquote
+import requests
 
 
 
@@ -19,6 +26,11 @@ def homedir():
     return os.path.expanduser('~')
 
 
+# Return the directory to keep caches of pyslib, e.g., indexes of remote directories.
+def cachedir():
+    return os.path.join(homedir(), '.pyslib')
+
+
 # Return the directory of the given external disk.
 def diskdir(disk):
     platform = sys.platform
@@ -59,20 +71,316 @@ def get_extension(file):
 
 
 
+# The version in a file name, e.g., v02 or v7.1.0.
+version_re = re.compile(r'v(\d+(?:\.\d+)*)')
+
+
+def split_version(name):
+    """
+    Return the name with its last version replaced by v*, and the version
+    as a tuple of numbers. Or None if there is no version.
+    """
+    matches = list(version_re.finditer(name))
+    if len(matches) == 0: return None
+    match = matches[-1]
+    key = name[:match.start()]+'v*'+name[match.end():]
+    return key, tuple(int(x) for x in match.group(1).split('.'))
+
+
+def last_version(names, pattern):
+    """
+    Return the name that matches a pattern and has the highest version,
+    or the last in sorted order if there is no version. Or None.
+    """
+    names = sorted(fnmatch.filter(names, pattern))
+    if len(names) == 0: return None
+    def version(name):
+        the_version = split_version(name)
+        return () if the_version is None else the_version[1]
+    return max(reversed(names), key=version)
+
+
+# Settings of downloading.
+download_workers = 4
+download_retries = 3
+download_timeout = 60
+download_chunk_size = 1024*1024
+# Set to False to skip checking the SSL/TLS certificate, for servers whose certificates cannot be verified.
+download_verify = True
+# Set to False to not print the downloaded files and the throughput. Failures are always printed.
+download_verbose = True
+
+# HTTP sessions, keyed by scheme and host, to reuse connections.
+_sessions = dict()
+_sessions_lock = threading.Lock()
+# Locks of remote directories and local files, so each is done by one worker at a time.
+_locks = dict()
+
+
+def _lock_of(key):
+    with _sessions_lock:
+        return _locks.setdefault(key, threading.Lock())
+
+
+def get_session(url):
+    """
+    Return the HTTP session of the host of a URL.
+    """
+    parts = urlsplit(url)
+    key = (parts.scheme, parts.netloc)
+    with _sessions_lock:
+        session = _sessions.get(key, None)
+        if session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_maxsize=max(download_workers,10))
+            session.mount(parts.scheme+'://', adapter)
+            _sessions[key] = session
+    return session
+
+
+# Indexes of remote directories, keyed by URL, as [time fetched, names].
+# They are reused for remote_index_ttl sec, and saved in cachedir().
+remote_index_ttl = 86400.
+_remote_indexes = None
+_remote_indexes_lock = threading.Lock()
+
+
+def remote_index_file():
+    return os.path.join(cachedir(), 'remote_index.json')
+
+
+def _read_json(file):
+    try:
+        with open(file) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return dict()
+
+
+def _write_json(file, data):
+    # Write to a temp file first, so readers never see a partial file.
+    tmp_file = file+f'.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        with open(tmp_file, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_file, file)
+    except OSError:
+        pass
+
+
+def _load_remote_indexes():
+    global _remote_indexes
+    with _remote_indexes_lock:
+        if _remote_indexes is None:
+            _remote_indexes = _read_json(remote_index_file())
+    return _remote_indexes
+
+
+def _save_remote_indexes():
+    with _remote_indexes_lock:
+        indexes = dict(_remote_indexes)
+    _write_json(remote_index_file(), indexes)
+
+
+def list_remote_dir(remote_dir, ttl=None):
+    """
+    Return the names linked in the index page of a remote directory.
+    The index is cached in memory and on disk, and fetched again after ttl sec.
+    :param ttl: by default remote_index_ttl. Set to 0 to fetch anyway.
+    """
+    if ttl is None: ttl = remote_index_ttl
+    indexes = _load_remote_indexes()
+    with _lock_of(remote_dir):
+        index = indexes.get(remote_dir, None)
+        if index is not None and time.time()-index[0] < ttl:
+            return index[1]
+        names = _fetch_remote_dir(remote_dir)
+        with _remote_indexes_lock:
+            indexes[remote_dir] = [time.time(), names]
+    _save_remote_indexes()
+    return names
+
+
+def _fetch_remote_dir(remote_dir):
+    response = get_session(remote_dir).get(remote_dir,
+        timeout=download_timeout, verify=download_verify)
+    response.raise_for_status()
+    names = list()
+    for href in re.findall(r'href="([^"]+)"', response.text, flags=re.IGNORECASE):
+        href = unquote(href.split('?')[0])
+        if href.endswith('/'): continue
+        names.append(os.path.basename(href))
+    return names
+
+
+# Files known to be missing, keyed by path, as [reason, time recorded].
+# They are not tried again for missing_file_expiry sec, and saved in cachedir().
+missing_file_expiry = 86400.
+_missing_files = None
+_missing_files_lock = threading.Lock()
+
+
+def missing_file_record():
+    return os.path.join(cachedir(), 'missing_files.json')
+
+
+def _load_missing_files():
+    global _missing_files
+    with _missing_files_lock:
+        if _missing_files is None:
+            _missing_files = _read_json(missing_file_record())
+    return _missing_files
+
+
+def mark_missing(files, reason=''):
+    """
+    Record files, or patterns of files, as missing for a reason.
+    """
+    if type(files) is str: files = [files]
+    missing_files = _load_missing_files()
+    with _missing_files_lock:
+        for file in files:
+            missing_files[file] = [reason, time.time()]
+        record = dict(missing_files)
+    _write_json(missing_file_record(), record)
+
+
+def unmark_missing(files):
+    if type(files) is str: files = [files]
+    missing_files = _load_missing_files()
+    with _missing_files_lock:
+        for file in files:
+            missing_files.pop(file, None)
+        record = dict(missing_files)
+    _write_json(missing_file_record(), record)
+
+
+def is_missing(file, expiry=None):
+    """
+    Return the reason if a file is recorded as missing within expiry sec,
+    or None. By default expiry is missing_file_expiry.
+    """
+    if expiry is None: expiry = missing_file_expiry
+    missing_files = _load_missing_files()
+    with _missing_files_lock:
+        record = missing_files.get(file, None)
+    if record is None: return None
+    if time.time()-record[1] >= expiry: return None
+    return record[0]
+
+
+def _fetch_file(remote_file, local_file):
+    """
+    Download a URL to a file. Data go to local_file.part first, which is
+    resumed if it exists, and renamed to local_file when complete.
+    :return: the number of bytes received.
+    """
+    session = get_session(remote_file)
+    tmp_file = local_file+'.part'
+    offset = os.path.getsize(tmp_file) if os.path.exists(tmp_file) else 0
+    headers = {'Range': f'bytes={offset}-'} if offset > 0 else dict()
+    with session.get(remote_file, headers=headers, stream=True,
+            timeout=download_timeout, verify=download_verify) as response:
+        # The partial file is not part of the remote file, start over.
+        if response.status_code == 416:
+            os.remove(tmp_file)
+            return _fetch_file(remote_file, local_file)
+        response.raise_for_status()
+        # The server may send the whole file for a range.
+        if response.status_code != 206: offset = 0
+        size = response.headers.get('Content-Length', None)
+        nbyte = 0
+        with open(tmp_file, 'ab' if offset > 0 else 'wb') as f:
+            for chunk in response.iter_content(download_chunk_size):
+                f.write(chunk)
+                nbyte += len(chunk)
+    if size is not None and nbyte < int(size):
+        raise IOError(f'Incomplete download of {remote_file} ...')
+    os.replace(tmp_file, local_file)
+    return nbyte
+
+
+def _download_one(remote_file, local_file):
+    """
+    Download one file, see download_files.
+    :return: the local file, or None, and the number of bytes received.
+    """
+    remote_dir = os.path.dirname(remote_file)+'/'
+    local_dir = os.path.dirname(local_file)
+    base = os.path.basename(remote_file)
+    # Skip files known to be missing on the server.
+    if is_missing(local_file) is not None: return None, 0
+    the_local_file = local_file
+
+    # Find the last version on the server.
+    if any(char in base for char in '*?['):
+        try:
+            base = last_version(list_remote_dir(remote_dir), base)
+        except (requests.RequestException, IOError) as error:
+            print(f'Failed to list {remote_dir}: {error}')
+            return None, 0
+        if base is None:
+            mark_missing(the_local_file, f'{remote_file} is not on the server')
+            return None, 0
+        remote_file = urljoin(remote_dir, base)
+        local_file = os.path.join(local_dir, base)
+
+    # The same file may be asked for more than once.
+    with _lock_of(os.path.abspath(local_file)):
+        if os.path.exists(local_file): return local_file, 0
+
+        if local_dir != '': os.makedirs(local_dir, exist_ok=True)
+        for i in range(download_retries):
+            try:
+                return local_file, _fetch_file(remote_file, local_file)
+            except requests.HTTPError as error:
+                # Nothing to retry for 404 etc.
+                print(f'Failed to download {remote_file}: {error}')
+                if error.response is not None and error.response.status_code in (404,410):
+                    mark_missing(the_local_file, f'{remote_file} is not on the server')
+                return None, 0
+            except (requests.RequestException, IOError) as error:
+                print(f'Failed to download {remote_file}, attempt {i+1}: {error}')
+    return None, 0
+
+
+def download_files(remote_files, local_files, workers=None, verbose=None):
+    """
+    Download files from given URLs to local disk, with a pool of workers.
+    A remote file can have wildcards in its name, e.g., v*, then the last
+    version on the server is downloaded under its own name. Existing local
+    files are not downloaded again. Files not on the server are recorded
+    by mark_missing, and are not tried again until the record expires.
+    :param workers: the number of concurrent downloads, by default download_workers.
+    :param verbose: to print the downloaded files and the throughput, by default download_verbose.
+    :return: a list of local files, None for failed ones.
+    """
+    if workers is None: workers = download_workers
+    if verbose is None: verbose = download_verbose
+    tic = time.perf_counter()
+    nfile = 0
+    nbyte = 0
+    files = list()
+    with ThreadPoolExecutor(max_workers=max(workers,1)) as pool:
+        results = pool.map(_download_one, remote_files, local_files)
+        for local_file, the_nbyte in results:
+            files.append(local_file)
+            if the_nbyte == 0: continue
+            nfile += 1
+            nbyte += the_nbyte
+            if verbose: print(f'Downloaded {local_file} ({the_nbyte/1e6:.1f} MB)')
+    if verbose and nfile != 0:
+        dt = time.perf_counter()-tic
+        print(f'Downloaded {nfile} files, {nbyte/1e6:.1f} MB in {dt:.1f} sec, {nbyte/1e6/dt:.2f} MB/s')
+    return files
+
+
 def download_file(remote_file, local_file):
     """
     Download one file from a given URL to local disk.
     :param remote_file:
     :param local_file:
-    :return:
+    :return: the local file, or None if failed.
     """
-    remote_dir = os.path.dirname(remote_file)+'/'
-    local_dir = os.path.dirname(local_file)+'/'
-    base = os.path.basename(remote_file)
-    # verify=False to skip SSL/TLS certificate, which may stop downloading a file.
-    try:
-        local_file = download(remote_file=base, remote_path=remote_dir, local_path=local_dir, last_version=True, verify=True)
-    except:
-        local_file = download(remote_file=base, remote_path=remote_dir, local_path=local_dir, last_version=True, verify=False)
-    if len(local_file) == 0: return None
-    return local_file[0]
\ No newline at end of file
+    return download_files([remote_file], [local_file], workers=1)[0]
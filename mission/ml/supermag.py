@@ -2,6 +2,7 @@ import os
 import system.manager as smg
 from mission import ml
 import libs.epoch as epoch
+import libs.system as system
 import read.supermag
 import libs.math as math
 from libs.cdf import cdf
@@ -41,12 +42,17 @@ def aei(
     nonexist_files = file_request['nonexist_files']
     new_files = list()
     for file in nonexist_files:
+        # Skip files failed to generate recently.
+        if system.is_missing(file) is not None: continue
         file_times = file_request['file_times']
         local_files = file_request['local_files']
         index = local_files.index(file)
         flag = gen_file(file_times[index], file, input_id)
         if flag is True:
             new_files.append(file)
+        else:
+            system.mark_missing(file, f'Failed to generate {input_id} file')
+    smg.clear_dir_listings(new_files)
     for file in new_files:
         files.append(file)
         nonexist_files.remove(file)
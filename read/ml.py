@@ -474,7 +474,7 @@ def rbsp_hope_energy(
     time_range = smg.prepare_time_range(input_time_range)
     files = mission.ml.rbsp.hope_en_spec(time_range, probe=probe)
     energy_var = 'energy_bins_'+species
-    cdfid = libs.cdf.cdf(files[0])
+    cdfid = libs.cdf.open_cdf(files[0])
     return cdfid.read_var(energy_var)
 
 
@@ -1,40 +1,88 @@
 # from collections import OrderedDict
 import os
+import copy
+import fnmatch
+import hashlib
+import warnings
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 import xarray as xr
 import numpy as np
-from libs.cdf import cdf as cdf
-import numpy as np
+from libs.cdf import open_cdf
+import libs.cdf
+import libs.cdf_index as cdf_index
 import libs.epoch as epoch
-from pyspedas.utilities.time_string import time_string
 from pyspedas.utilities.time_double import time_double
 import system.constant as constant
 import libs.math as math
-from pathlib import Path
 import libs.system as system
 from libs.cotran import cotran as lib_cotran
 import libs.vector as vector
 
 
-# To store data in memory.
-from pyslib import data_quants
+# To store data in memory. Vars read from files can be dropped and read again, see set_memory_budget.
+import pyslib
+from system.store import var_store
+if not isinstance(pyslib.data_quants, var_store):
+    pyslib.data_quants = var_store(pyslib.data_quants, loader=lambda source: _read_source(source))
+data_quants = pyslib.data_quants
 
 def vars():
     """Get all vars saved in the system."""
     return data_quants.keys()
 
+def set_memory_budget(max_bytes=None, spill=False, spill_dir=None):
+    """
+    Set the max bytes of vars kept in memory, or None for no limit.
+    The least recently used vars read from files are dropped first, and read again when needed.
+    :param spill: set to write other vars, e.g., computed ones, to disk when over the budget.
+    :param spill_dir: the dir to write to. By default, a temporary dir removed at exit.
+    """
+    data_quants.max_bytes = max_bytes
+    data_quants.spill = spill
+    if spill_dir is not None: data_quants.spill_dir = spill_dir
+    data_quants.shrink()
+
+def memory_usage():
+    """Return the bytes of vars in memory."""
+    return data_quants.nbyte
+
 def update_data(var, data):
-    data_quants[var].values = data
+    the_var = data_quants[var]
+    the_var.values = data
+    # The data no longer match the key of the depend var, see cdf_read_var.
+    the_var.attrs.pop('axis_key', None)
+    # Set again to update the size, and the var no longer comes from its source.
+    data_quants[var] = the_var
 
 def set_data(var, data, settings=None):
-    data_quants[var] = xr.DataArray(data)
-    data_quants[var].name = var
+    """
+    Store the data and settings of a var.
+    :param data: an array, or a deferred read from lazy_data, which is read on first get_data.
+    """
+    if isinstance(data, dict):
+        data_quants.set_lazy(var, data)
+        dims = _lazy_shape(data)
+    else:
+        data_quants[var] = xr.DataArray(data)
+        data_quants[var].name = var
+        dims = data.shape
     if settings is not None:
         set_setting(var, settings)
 
     # More smart actions.
+    set_setting(var, default_settings(get_setting(var), dims))
+
+
+def default_settings(settings, dims):
+    """
+    Return the settings to add for a var of given settings and shape, e.g., display_type and unit.
+    """
+    the_settings = dict()
+
     key = 'display_type'
-    if get_setting(var, key) is None:
-        dims = data.shape
+    display_type = settings.get(key, None)
+    if display_type is None:
         if len(dims) == 2:
             if dims[1] == 3:
                 display_type = 'vector'
@@ -42,55 +90,146 @@ def set_data(var, data, settings=None):
                 display_type = 'list'
         elif len(dims) == 1:
             display_type = 'scalar'
-        else:
-            display_type = None
         if display_type is not None:
-            set_setting(var, {key: display_type})
-    display_type = get_setting(var, key)
+            the_settings[key] = display_type
     
     if display_type == 'vector':
         key = 'coord_labels'
-        if get_setting(var, key) is None:
-            val = list('xyz')
-            set_setting(var, {key: val})
+        if settings.get(key, None) is None:
+            the_settings[key] = list('xyz')
     
     key = 'unit'
-    if get_setting(var, key) is None:
-        unit = get_setting(var, 'UNITS')
+    if settings.get(key, None) is None:
+        unit = settings.get('UNITS', None)
         if unit is not None:
             unit = unit.replace('!U', '$^{')
             unit = unit.replace('!E', '$^{')
             unit = unit.replace('!N', '}$')
-            set_setting(var, {key: unit})
+            the_settings[key] = unit
 
     key = 'time_var'
-    if get_setting(var, key) is None:
-        dep_vars = get_setting(var, 'depend_vars')
+    if settings.get(key, None) is None:
+        dep_vars = settings.get('depend_vars', None)
         if dep_vars is not None:
-            time_var = dep_vars[0]
-            set_time_var(var, time_var)
-    
+            the_settings[key] = dep_vars[0]
+
+    return the_settings
+
+
+def lazy_data(
+    var,
+    files,
+    rec_range=None,
+    step=1,
+    time_var=None,
+    time_format=None,
+    convert_time=False,
+    workers=1,
+    executor='thread',
+    mmap=False,
+):
+    """
+    Return a deferred read of a var over files, for set_data.
+    :param rec_range: the record range in each file, see _locate_rec_range. By default, all records.
+    :param time_var: the time var to find records in a time range, see get_data.
+    :param convert_time: set for a time var, to convert it from time_format to default_time_format.
+    """
+    if rec_range is None: rec_range = [[] for file in files]
+    if time_var is not None and time_format is None:
+        time_format = (open_cdf(files[0]).read_var_info(time_var))['cdf_type']
+    return dict(var=var, files=files, rec_range=rec_range, step=step,
+        time_var=time_var, time_format=time_format, convert_time=convert_time,
+        workers=workers, executor=executor, mmap=mmap)
+
+
+def _lazy_shape(source):
+    # The number of records is not known before reading, only the other dims.
+    data_info = open_cdf(source['files'][0]).read_var_info(source['var'])
+    dims = data_info['dims']
+    if len(dims) == 1 and dims[0] == 0: dims = []
+    if not data_info['rec_vary']: return tuple(dims)
+    return (None,)+tuple(dims)
+
+
+def _intersect_rec_range(range0, range1, step=1):
+    # Records in both ranges, on the step of range0.
+    if len(range0) == 0: range0 = [0, range1[1]]
+    rec0 = range0[0]
+    if range1[0] > rec0: rec0 += -(-(range1[0]-rec0)//step)*step
+    rec1 = min(range0[1], range1[1])
+    if rec1 <= rec0: return [0,0]
+    return [rec0, rec1]
 
 
+# Depend vars read from files, keyed by depend_key, to the vars that keep them.
+_depend_vars = dict()
 
 
+def depend_key(depend_var, files, rec_range, step=1, aggregate=None, block=None, bin_size=None):
+    """
+    Return a hash of what is read for a depend var, i.e., the var, the files and their stamps,
+    the record ranges, and the step. Vars of the same key share one depend var.
+    """
+    stamps = list()
+    for file in files:
+        stat = os.stat(file)
+        stamps.append((os.path.abspath(file), stat.st_mtime_ns, stat.st_size))
+    key = (depend_var, stamps, [list(range) for range in rec_range], step, aggregate, block, bin_size)
+    return hashlib.sha1(repr(key).encode()).hexdigest()
+
+
+def _read_lazy(source, time_range=None):
+    """
+    Read a var from lazy_data, optionally only the records in a time range.
+    """
+    files = source['files']
+    rec_range = source['rec_range']
+    step = source['step']
+    time_var = source['time_var']
+    time_format = source['time_format']
+    if time_range is not None and time_var is not None:
+        tr = epoch.convert_time(prepare_time_range(time_range), input=default_time_format, output=time_format)
+        rec_range = [_intersect_rec_range(range0, range1, step=step)
+            for range0, range1 in zip(rec_range, _locate_rec_range(files, time_var, tr))]
+    data, data_setting = _cdf_read_var(source['var'], files, rec_range=rec_range, step=step,
+        workers=source['workers'], executor=source['executor'], mmap=source['mmap'])
+    if source['convert_time']:
+        data = epoch.convert_time(data, input=time_format, output=default_time_format)
+    return data
+
 
 def set_setting(var, settings):
-    data_quants[var].attrs.update(settings)
+    data_quants.attrs(var).update(settings)
+
+def get_data(var, time_range=None):
+    """
+    Return the data of a var.
+    :param time_range: to return only the data in the time range. For a var not read yet,
+        only the records in the time range are read, and the var is not kept in memory.
+        A var without time_var is taken as times.
+    """
+    if time_range is None: return data_quants[var].values
 
-def get_data(var):
-    return data_quants[var].values
+    source = data_quants.get_source(var)
+    if isinstance(source, dict) and not data_quants.is_resident(var):
+        return _read_lazy(source, time_range=time_range)
+    tr = prepare_time_range(time_range)
+    time_var = get_time_var(var)
+    times = get_data(var if time_var is None else time_var)
+    index = (times >= tr[0]) & (times <= tr[1])
+    return get_data(var)[index]
 
 def get_setting(var, key=None):
-    settings = data_quants[var].attrs
+    settings = data_quants.attrs(var)
     if key is None: return settings
     else: return settings.get(key, None)
 
-def get_time(var):
-    return get_data(get_time_var(var))
+def get_time(var, time_range=None):
+    return get_data(get_time_var(var), time_range=time_range)
 
 def get_time_var(var):
-    return data_quants[var].attrs.get('time_var', None)
+    return data_quants.attrs(var).get('time_var', None)
+
 
 def set_time_var(var, time_var):
     dep_vars = get_depend_vars(var)
@@ -107,14 +246,14 @@ def set_time_var(var, time_var):
     set_setting(var, settings)
 
 def get_depend_vars(var):
-    return data_quants[var].attrs.get('depend_vars', None)
+    return data_quants.attrs(var).get('depend_vars', None)
 
 def set_depend_vars(var, dep_vars):
     set_setting(var, {'depend_vars': dep_vars})
 
 def rename(var, out_var=None):
     if out_var is None: return
-    data_quants[out_var] = data_quants.pop(var)
+    data_quants.rename(var, out_var)
 
 def has_var(var):
     return var in data_quants.keys()
@@ -221,118 +360,393 @@ def merge(in_vars, output=None, time_var=None, settings=None):
 
         
 
+def _read_file_slice(file, var, range, step=1, mmap=False):
+    # Module level so that it can be sent to a process pool.
+    # var can be a list, to read the vars from the file at once.
+    cdfid = open_cdf(file)
+    if isinstance(var, list):
+        return [cdfid.read_var(the_var, range, step, mmap=mmap) for the_var in var]
+    return cdfid.read_var(var, range, step, mmap=mmap)
+
+
+def _read_file_slices(var, files, rec_range, step=1, workers=1, executor='thread', mmap=False):
+    """
+    Return an iterator of the data read from each file, in file order.
+    :param var: a var, or a list of vars to read a list of data from each file.
+    :param workers: the number of files read concurrently.
+    :param executor: 'thread' or 'process'. The CDF library behind pycdf is not
+        thread-safe, so for threads the files are opened and their metadata read
+        here, and threads read with cdflib or np.memmap only. Processes each load
+        their own CDF library and read with pycdf.
+    """
+    nfile = len(files)
+    if workers <= 1 or nfile <= 1:
+        return (_read_file_slice(file, var, range, step, mmap=mmap) for range, file in zip(rec_range,files))
+
+    if executor == 'thread':
+        the_vars = var if isinstance(var, list) else [var]
+        plans = [[open_cdf(file).plan_read(the_var, range, step, mmap=mmap) for the_var in the_vars]
+            for range, file in zip(rec_range,files)]
+        def results():
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                for data in pool.map(libs.cdf.read_planned, files, plans):
+                    yield data if isinstance(var, list) else data[0]
+        return results()
+    elif executor == 'process':
+        pool = ProcessPoolExecutor(max_workers=workers)
+    else:
+        raise ValueError(f'Unknown executor: {executor} ...')
+
+    def results():
+        with pool:
+            yield from pool.map(_read_file_slice, files, [var]*nfile,
+                rec_range, [step]*nfile, [mmap]*nfile)
+    return results()
+
+
 def _cdf_read_var(
     var='',
     files=[],
     rec_range=None,
     step=1,
+    workers=1,
+    executor='thread',
+    mmap=False,
 ):
+    return _cdf_read_vars([var], files, rec_range=rec_range, step=step,
+        workers=workers, executor=executor, mmap=mmap)[var]
 
-    cdfid = cdf(files[0])
-    data_info = cdfid.read_var_info(var)
-    data_setting = cdfid.read_setting(var)
 
-    rec_vary = data_info['rec_vary']
-    if not rec_vary:
-        data = cdfid.read_var(var)
-        return data, data_setting
-
-    var_dim = data_info['dims']
-    dim = [0]
-    if len(var_dim) == 1 and var_dim[0] == 0:
-        pass
-    else:
-        dim.extend(var_dim)
+def _cdf_read_vars(
+    vars=[],
+    files=[],
+    rec_range=None,
+    step=1,
+    workers=1,
+    executor='thread',
+    mmap=False,
+):
+    """
+    Read vars over files in one pass, i.e., each file is read once for all vars.
+    :return: a dict of var to (data, setting).
+    """
 
+    cdfid = open_cdf(files[0])
+    results = dict()
+    rec_vars = list()
+    dims = dict()
+    for var in vars:
+        data_info = cdfid.read_var_info(var)
+        data_setting = cdfid.read_setting(var)
+        if not data_info['rec_vary']:
+            results[var] = (cdfid.read_var(var), data_setting)
+            continue
+        var_dim = data_info['dims']
+        dim = [0]
+        if len(var_dim) == 1 and var_dim[0] == 0:
+            pass
+        else:
+            dim.extend(var_dim)
+        rec_vars.append(var)
+        dims[var] = dim
+        results[var] = (data_info, data_setting)
+    if len(rec_vars) == 0: return results
+
+
+    # Count records first, so the data can be read into one array in place.
+    nrecs = {var: list() for var in rec_vars}
+    for the_range, file in zip(rec_range,files):
+        the_cdfid = open_cdf(file)
+        for var in rec_vars:
+            nrecs[var].append(the_cdfid.count_rec(var, the_range, step))
+    for var in rec_vars:
+        dims[var][0] = sum(nrecs[var])
 
     # Read data.
-    data = np.empty(dim)
-    for range, file in zip(rec_range,files):
-        cdfid = cdf(file)
-        data = np.concatenate((data,cdfid.read_var(var, range, step)), axis=0)
+    index = [i for i in range(len(files)) if any(nrecs[var][i] != 0 for var in rec_vars)]
+    the_files = [files[i] for i in index]
+    the_ranges = [rec_range[i] for i in index]
+    all_data = _read_file_slices(rec_vars, the_files, the_ranges, step=step,
+        workers=workers, executor=executor, mmap=mmap)
+    # Keep the memory mapped views as is, when there is nothing to stitch.
+    if mmap and len(the_files) == 1:
+        for var, the_data in zip(rec_vars, next(all_data)):
+            results[var] = (the_data, results[var][1])
+        return results
+    data = {var: None for var in rec_vars}
+    rec0 = {var: 0 for var in rec_vars}
+    for i, file_data in zip(index, all_data):
+        for var, the_data in zip(rec_vars, file_data):
+            nrec = nrecs[var][i]
+            if nrec == 0: continue
+            # Use the dtype as read, e.g., pycdf may return datetime objects.
+            if data[var] is None:
+                data[var] = np.empty(dims[var], dtype=the_data.dtype)
+            data[var][rec0[var]:rec0[var]+nrec] = the_data
+            rec0[var] += nrec
+
+    for var in rec_vars:
+        data_info, data_setting = results[var]
+        if data[var] is None:
+            dtype = libs.cdf.get_dtype(data_info['cdf_type'], data_info['nelem'])
+            data[var] = np.empty(dims[var], dtype=dtype)
+        results[var] = (data[var], data_setting)
+
+    return results
+
+
+def _locate_rec_range(files, time_var, time_range=None):
+    """
+    Return the record range [start,end) in each file for the times within
+    the time range. Times are monotonic, so the first and last records tell
+    whether a file can be skipped or taken as a whole, and the bounds in
+    the other files are found by binary search. Records that overlap with
+    the times in a previous file are excluded.
+
+    The first and last times and a sparse index of the times are read
+    from the time index of each file (see libs.cdf_index), so a file is
+    opened only when a bound falls in it.
+    :param time_range: in the format of time_var, or None for all times.
+    :return: a list of ranges, one for each file, [0,0] for no record.
+    """
 
-    return data, data_setting
+    rec_range = list()
+    pre_time = None
+    for file in files:
+        index = cdf_index.load_index(file, time_var)
+        nrec = index['nrec']
+        if nrec == 0:
+            rec_range.append([0,0])
+            continue
+        first_time = index['first_time']
+        last_time = index['last_time']
+        search_rec = lambda value, side: cdf_index.search_rec(file, time_var, index, value, side=side)
+
+        # The file is entirely outside the time range.
+        skip = pre_time is not None and last_time <= pre_time
+        if time_range is not None:
+            skip = skip or last_time < time_range[0] or first_time > time_range[1]
+        if skip:
+            rec_range.append([0,0])
+            continue
+
+        # Find the first record.
+        rec0 = 0
+        if time_range is not None and first_time < time_range[0]:
+            rec0 = search_rec(time_range[0], 'left')
+        if pre_time is not None and first_time <= pre_time:
+            rec0 = max(rec0, search_rec(pre_time, 'right'))
+
+        # Find the last record.
+        rec1 = nrec
+        if time_range is not None and last_time > time_range[1]:
+            rec1 = search_rec(time_range[1], 'right')
+
+        if rec1 <= rec0:
+            rec_range.append([0,0])
+            continue
+        rec_range.append([rec0,rec1])
+        if rec1 == nrec:
+            pre_time = last_time
+        else:
+            pre_time = open_cdf(file).read_var(time_var, [rec1-1])[0]
+
+    return rec_range
 
 
 def cdf_read_var(
     var,
     files,
+    **kwargs,
+):
+    """
+    Read a var and its depend vars over files, and store them in memory.
+    See cdf_read_vars for the keywords.
+    """
+    cdf_read_vars([var], files, **kwargs)
+
+
+def cdf_read_vars(
+    vars,
+    files,
     rec_range=None,
     step=1,
     time_range=None,
     time_var=None,
     time_format=None,
     read_depend_var=True,
+    workers=1,
+    executor='thread',
+    mmap=False,
+    aggregate=None,
+    block=None,
+    bin_size=None,
+    lazy=False,
 ):
+    """
+    Read vars and their depend vars over files, and store them in memory.
+    Vars of the same time var share the record ranges, which are located once,
+    and are read with their depend vars in one pass over the files.
+    :param aggregate: None, or a mode of aggregate_var, to reduce the var
+        over block records or bins of bin_size sec while reading it.
+        Record varying depend vars are reduced by mean.
+    :param lazy: set to store the vars with their settings, and read the data on first get_data.
+        Not used with aggregate.
+    """
 
     # Prepare time range.
     if time_range is None:
         tr = None
     else:
         tr = prepare_time_range(time_range)
-    
-    if time_var is None:
-        cdfid = cdf(files[0])
-        var_setting = cdfid.read_setting(var)
-        time_var = var_setting.get('DEPEND_0', None)
 
-    
-    # Prepare files.
-    if rec_range is None:
-        rec_range = list()
+    # Group vars by time var.
+    cdfid = open_cdf(files[0])
+    groups = OrderedDict()
+    for var in vars:
+        the_time_var = time_var
+        if the_time_var is None:
+            the_time_var = cdfid.read_setting(var).get('DEPEND_0', None)
+        groups.setdefault(the_time_var, list()).append(var)
+
+    for the_time_var, the_vars in groups.items():
+        the_time_format = time_format
+        if the_time_var is not None and the_time_format is None:
+            the_time_format = (cdfid.read_var_info(the_time_var))['cdf_type']
+
+        # Prepare files.
+        the_rec_range = rec_range
+        if the_rec_range is None:
+            # Use time to get range.
+            if the_time_var is not None:
+                the_tr = epoch.convert_time(tr, input=default_time_format, output=the_time_format)
+                the_rec_range = _locate_rec_range(files, the_time_var, the_tr)
+            else:
+                the_rec_range = [[] for file in files]
 
-        # Use time to get range.
-        if time_var is not None:
-            if time_format is None:
-                cdfid = cdf(files[0])
-                time_format = (cdfid.read_var_info(time_var))['cdf_type']
-            tr = epoch.convert_time(tr, input=default_time_format, output=time_format)
-            pre_times = None
-            for file in files:
-                cdfid = cdf(file)
-                # Read all times and trim to the given time range.
-                t = cdfid.read_var(time_var)
-                if tr is None:
-                    index = np.arange(len(t))
-                else:
-                    index = (np.where(np.logical_and(t>=tr[0], t<=tr[1])))[0]
-                if len(index) == 0: continue
-                range = [np.min(index),np.max(index)]
-                t = t[index]
-                # Avoid overlap in time.
-                if pre_times is not None:
-                    index = (np.where(t>pre_times[-1]))[0]
-                    range[0] += index[0]
-                    t = t[index[0]:]
-                pre_times = t
-                rec_range.append(range)
-        else:
-            for file in files:
-                cdfid = cdf(file)
-                var_info = cdfid.read_var_info(var)
-                range = [0,var_info['maxrec']]
-                rec_range.append(range)
+        _cdf_read_group(the_vars, files, the_rec_range, step=step,
+            time_var=the_time_var, time_format=the_time_format, read_depend_var=read_depend_var,
+            workers=workers, executor=executor, mmap=mmap,
+            aggregate=aggregate, block=block, bin_size=bin_size, lazy=lazy)
+
+
+def _find_depend_var(axis_key):
+    # The depend var of a key, if it is still kept.
+    depend_var = _depend_vars.get(axis_key, None)
+    if depend_var is None or not has_var(depend_var): return None
+    if get_setting(depend_var, 'axis_key') != axis_key: return None
+    return depend_var
 
-    # Read data and setting, store in memory.
-    data, data_setting = _cdf_read_var(var, files, rec_range=rec_range, step=step)
-    set_data(var, data, settings=data_setting)
 
+def _cdf_read_group(
+    vars,
+    files,
+    rec_range,
+    step=1,
+    time_var=None,
+    time_format=None,
+    read_depend_var=True,
+    workers=1,
+    executor='thread',
+    mmap=False,
+    aggregate=None,
+    block=None,
+    bin_size=None,
+    lazy=False,
+):
+    """
+    Read vars of the same time var and record ranges, see cdf_read_vars.
+    """
 
-    # Read depend_var.
-    if read_depend_var is True:
+    cdfid = open_cdf(files[0])
+    lazy = lazy and aggregate is None
+    settings = dict()
+    aggregates = dict()
+    for var in vars:
+        settings[var] = cdfid.read_setting(var)
+        # Nothing to reduce for a var that does not vary by record.
+        aggregates[var] = aggregate
+        if aggregate is not None and not cdfid.read_var_info(var)['rec_vary']:
+            aggregates[var] = None
+
+    # Plan the vars and depend vars to read in one pass.
+    pass_vars = list()
+    if not lazy:
+        for var in vars:
+            if aggregates[var] is not None: continue
+            if var not in pass_vars: pass_vars.append(var)
+            if read_depend_var is not True: continue
+            for key in settings[var]:
+                if 'depend' not in key.lower(): continue
+                depend_var = settings[var][key]
+                axis_key = depend_key(depend_var, files, rec_range, step=step,
+                    aggregate=None, block=block, bin_size=bin_size)
+                if _find_depend_var(axis_key) is not None: continue
+                if depend_var not in pass_vars: pass_vars.append(depend_var)
+    pass_data = dict()
+    if len(pass_vars) != 0:
+        pass_data = _cdf_read_vars(pass_vars, files, rec_range=rec_range, step=step,
+            workers=workers, executor=executor, mmap=mmap)
+
+    for var in vars:
+        # Read data and setting, store in memory.
+        data_setting = settings[var]
+        the_aggregate = aggregates[var]
+        agg_kwargs = dict(block=block, bin_size=bin_size, step=step,
+            rec_range=rec_range, time_var=time_var, time_format=time_format)
+        lazy_kwargs = dict(step=step, time_format=time_format, workers=workers, executor=executor, mmap=mmap)
+        if lazy:
+            data = lazy_data(var, files, rec_range, time_var=time_var, **lazy_kwargs)
+        elif the_aggregate is None:
+            data, data_setting = pass_data[var]
+        else:
+            agg_times, data = aggregate_var(var, files, mode=the_aggregate, **agg_kwargs)
+        set_data(var, data, settings=data_setting)
+        # Record how to read the var again, for the memory budget. Aggregated vars are kept.
+        if not lazy and the_aggregate is None:
+            data_quants.set_source(var, lazy_data(var, files, rec_range, time_var=time_var, **lazy_kwargs))
+
+        # Read depend_var.
+        if read_depend_var is not True: continue
         depend_vars = list()
         for key in data_setting:
             if 'depend' not in key.lower(): continue
             # Get the depend_var, data, and setting.
             depend_var = data_setting[key]
-            data, the_data_setting = _cdf_read_var(depend_var, files, rec_range, step=step)
-            if depend_var == time_var:
-                data = epoch.convert_time(data, input=time_format, output=default_time_format)
+            # The same depend var read before for other vars is used as is.
+            axis_key = depend_key(depend_var, files, rec_range, step=step,
+                aggregate=the_aggregate, block=block, bin_size=bin_size)
+            uniq_depend_var = _find_depend_var(axis_key)
+            if uniq_depend_var is not None:
+                depend_vars.append(uniq_depend_var)
+                if time_var in depend_var:
+                    set_time_var(var, uniq_depend_var)
+                continue
+
+            the_data_setting = cdfid.read_setting(depend_var)
+            if lazy:
+                rec_vary = cdfid.read_var_info(depend_var)['rec_vary']
+                data = lazy_data(depend_var, files, rec_range, time_var=time_var if rec_vary else None,
+                    convert_time=depend_var == time_var, **lazy_kwargs)
+            elif the_aggregate is not None and depend_var == time_var:
+                data = agg_times
+            elif the_aggregate is not None and cdfid.read_var_info(depend_var)['rec_vary']:
+                data = aggregate_var(depend_var, files, mode='mean', **agg_kwargs)[1]
+            else:
+                if depend_var in pass_data:
+                    data, the_data_setting = pass_data[depend_var]
+                else:
+                    data, the_data_setting = _cdf_read_var(depend_var, files, rec_range, step=step,
+                        workers=workers, executor=executor)
+                if depend_var == time_var:
+                    data = epoch.convert_time(data, input=time_format, output=default_time_format)
             # Need to avoid overwriting existing var.
             uniq_depend_var = depend_var
             while has_var(uniq_depend_var):
-                # No need to update the depend_var.
-                if np.array_equal(data, get_data(uniq_depend_var)):
+                # No need to update the depend_var. A var of another key is different,
+                # and a lazy var cannot be compared.
+                if not lazy and get_setting(uniq_depend_var, 'axis_key') is None \
+                    and np.array_equal(data, get_data(uniq_depend_var)):
                     break
                 else:
                     # Change to a different name and try again.
@@ -340,6 +754,12 @@ def cdf_read_var(
             else:
                 # If depend_var does not exist, then save the data and setting.
                 set_data(uniq_depend_var, data, settings=the_data_setting)
+                if not lazy and the_aggregate is None:
+                    rec_vary = cdfid.read_var_info(depend_var)['rec_vary']
+                    data_quants.set_source(uniq_depend_var, lazy_data(depend_var, files, rec_range,
+                        time_var=time_var if rec_vary else None, convert_time=depend_var == time_var, **lazy_kwargs))
+            set_setting(uniq_depend_var, {'axis_key': axis_key})
+            _depend_vars[axis_key] = uniq_depend_var
             depend_vars.append(uniq_depend_var)
 
             if time_var in depend_var:
@@ -348,6 +768,162 @@ def cdf_read_var(
 
 
 
+def iter_var(
+    var,
+    files,
+    time_range=None,
+    chunk_records=1000000,
+    step=1,
+    rec_range=None,
+    time_var=None,
+    time_format=None,
+):
+    """
+    Read a var over files in chunks, for processing data larger than memory.
+    :param chunk_records: the max number of records in each chunk.
+    :return: a generator of (times, data), times are in default_time_format,
+        or None if the var does not depend on time.
+    """
+
+    if time_var is None:
+        cdfid = open_cdf(files[0])
+        time_var = cdfid.read_setting(var).get('DEPEND_0', None)
+    if time_var is not None and time_format is None:
+        cdfid = open_cdf(files[0])
+        time_format = (cdfid.read_var_info(time_var))['cdf_type']
+
+    if rec_range is None:
+        if time_var is not None:
+            tr = prepare_time_range(time_range)
+            tr = epoch.convert_time(tr, input=default_time_format, output=time_format)
+            rec_range = _locate_rec_range(files, time_var, tr)
+        else:
+            rec_range = [[] for file in files]
+
+    for range, file in zip(rec_range,files):
+        cdfid = open_cdf(file)
+        if cdfid.count_rec(var, range, step) == 0: continue
+        datas = cdfid.iter_var(var, range, step, chunk_records=chunk_records)
+        if time_var is None:
+            for data in datas:
+                yield None, data
+            continue
+        times = cdfid.iter_var(time_var, range, step, chunk_records=chunk_records)
+        for the_times, data in zip(times,datas):
+            the_times = epoch.convert_time(the_times, input=time_format, output=default_time_format)
+            yield the_times, data
+
+
+aggregate_modes = ['mean','min','max','envelope','median']
+
+
+def _reduce_groups(data, starts, mode):
+    """
+    Reduce data over groups of consecutive records, NaNs are ignored.
+    :param starts: the index of the first record of each group.
+    :return: an array of [ngroup,...], with an extra trailing dimension
+        of [min,max] for envelope.
+    """
+    if mode == 'mean':
+        data = np.asarray(data, dtype=float)
+        valid = np.isfinite(data)
+        counts = np.add.reduceat(valid, starts, axis=0)
+        sums = np.add.reduceat(np.where(valid, data, 0), starts, axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return sums/counts
+    elif mode == 'min':
+        return np.fmin.reduceat(data, starts, axis=0)
+    elif mode == 'max':
+        return np.fmax.reduceat(data, starts, axis=0)
+    elif mode == 'envelope':
+        return np.stack([
+            np.fmin.reduceat(data, starts, axis=0),
+            np.fmax.reduceat(data, starts, axis=0)], axis=-1)
+    elif mode == 'median':
+        data = np.asarray(data, dtype=float)
+        groups = np.split(data, starts[1:], axis=0)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            return np.stack([np.nanmedian(group, axis=0) for group in groups])
+    raise Exception(f'Unknown aggregate mode: {mode} ...')
+
+
+def aggregate_var(
+    var,
+    files,
+    mode='mean',
+    block=None,
+    bin_size=None,
+    **kwargs,
+):
+    """
+    Reduce a var over blocks of records or bins of time, while reading it in chunks.
+    Only a chunk and the last unfinished group are kept in memory.
+    :param mode: 'mean', 'min', 'max', 'envelope' (min and max), or 'median'.
+    :param block: the number of records in each group.
+    :param bin_size: the width of time bins in sec, the bins are aligned to
+        multiples of bin_size. Empty bins are omitted.
+    :param kwargs: passed to iter_var.
+    :return: times and data. Times are the bin centers for bin_size, or the
+        mean time of each block for block.
+    """
+
+    if mode not in aggregate_modes:
+        raise Exception(f'Unknown aggregate mode: {mode} ...')
+    if block is None and bin_size is None:
+        raise Exception('Need block or bin_size ...')
+    if block is not None: block = int(block)
+
+    out_times = list()
+    out_datas = list()
+    out_labels = list()
+    carry = None
+    rec0 = 0
+    for times, data in iter_var(var, files, **kwargs):
+        nrec = len(data)
+        if block is not None:
+            labels = (rec0+np.arange(nrec))//block
+        else:
+            if times is None:
+                raise Exception(f'{var} does not depend on time, use block instead ...')
+            labels = np.floor(times/bin_size).astype(np.int64)
+        rec0 += nrec
+
+        if carry is not None:
+            times = None if times is None else np.concatenate([carry[0],times])
+            data = np.concatenate([carry[1],data])
+            labels = np.concatenate([carry[2],labels])
+        starts = np.flatnonzero(np.r_[True, labels[1:] != labels[:-1]])
+
+        # The last group may continue in the next chunk.
+        last = starts[-1]
+        carry = (None if times is None else times[last:], data[last:], labels[last:])
+        if last == 0: continue
+        starts = starts[:-1]
+        out_datas.append(_reduce_groups(data[:last], starts, mode))
+        out_labels.append(labels[starts])
+        if times is not None:
+            out_times.append(np.add.reduceat(times[:last], starts)/np.diff(np.r_[starts,last]))
+
+    if carry is not None:
+        times, data, labels = carry
+        out_datas.append(_reduce_groups(data, [0], mode))
+        out_labels.append(labels[:1])
+        if times is not None:
+            out_times.append(np.mean(times, keepdims=True))
+
+    if len(out_datas) == 0:
+        return np.empty(0), np.empty(0)
+    data = np.concatenate(out_datas)
+    if len(out_times) == 0:
+        times = None
+    elif bin_size is not None:
+        times = (np.concatenate(out_labels)+0.5)*bin_size
+    else:
+        times = np.concatenate(out_times)
+    return times, data
+
+
 def read_var(var_request):
 
     files = var_request.get('files', None)
@@ -361,9 +937,22 @@ def read_var(var_request):
     time_var = var_request.get('time_var', None)
     time_range = var_request.get('time_range', None)
     if step < 1: step = 1
-    for var in in_vars:
-        if extension == '.cdf':
-            cdf_read_var(var, files, time_range=time_range, time_var=time_var, step=step)
+    # Optionally read files concurrently, with a pool of 'thread' or 'process'.
+    workers = int(var_request.get('workers', 1))
+    executor = var_request.get('executor', 'thread')
+    # Optionally map uncompressed data from disk instead of reading them.
+    mmap = var_request.get('mmap', False)
+    # Optionally reduce data while reading, over 'block' records or time bins of 'bin_size' sec.
+    aggregate = var_request.get('aggregate', None)
+    block = var_request.get('block', None)
+    bin_size = var_request.get('bin_size', None)
+    # Optionally store the vars with their settings only, and read the data on first get_data.
+    lazy = var_request.get('lazy', False)
+    # All vars are read together, in one pass over the files.
+    if extension == '.cdf':
+        cdf_read_vars(in_vars, files, time_range=time_range, time_var=time_var, step=step,
+            workers=workers, executor=executor, mmap=mmap,
+            aggregate=aggregate, block=block, bin_size=bin_size, lazy=lazy)
 
     out_vars = var_request.get('out_vars', [])
     if len(out_vars) != len(in_vars): out_vars = in_vars
@@ -374,21 +963,136 @@ def read_var(var_request):
     return out_vars
 
 
+def _read_source(source):
+    """
+    Read a var again, source is a dict from lazy_data. Only its data are read,
+    other vars and the depend vars of other reads are not changed.
+    """
+    data = xr.DataArray(_read_lazy(source))
+    data.name = source['var']
+    return data
+
+
+# Listings of directories, keyed by directory, as [mtime, sorted names, version index].
+_dir_listings = dict()
+
+
+def _get_listing(path):
+    try:
+        mtime = os.stat(path if path != '' else '.').st_mtime_ns
+    except OSError:
+        _dir_listings.pop(path, None)
+        return None
+    listing = _dir_listings.get(path, None)
+    if listing is None or listing[0] != mtime:
+        listing = [mtime, sorted(os.listdir(path if path != '' else '.')), None]
+        _dir_listings[path] = listing
+    return listing
+
+
+def clear_dir_listings(files=None):
+    """
+    Drop the cached listings of the directories of files, or all if no files are given.
+    Use it after writing files, since the mtime of a directory may not change within
+    its resolution, e.g., 1 sec on HFS+, 2 sec on FAT, or longer with NFS attribute caching.
+    """
+    if files is None:
+        _dir_listings.clear()
+        return
+    for file in files:
+        _dir_listings.pop(os.path.dirname(file), None)
+
+
+def list_dir(path):
+    """
+    Return the sorted names in a directory, or [] if it does not exist.
+    The listing is cached until the mtime of the directory changes.
+    """
+    listing = _get_listing(path)
+    if listing is None: return []
+    return listing[1]
+
+
+def version_index(path):
+    """
+    Return a dict from names with the version replaced by v*, to the names
+    of the highest version in a directory. Versions are compared by numbers,
+    so v10 is after v9, and v7.1.0 is after v7.0.9.
+    """
+    listing = _get_listing(path)
+    if listing is None: return dict()
+    if listing[2] is None:
+        index = dict()
+        versions = dict()
+        for name in listing[1]:
+            the_version = system.split_version(name)
+            if the_version is None: continue
+            key, version = the_version
+            if key not in versions or version > versions[key]:
+                versions[key] = version
+                index[key] = name
+        listing[2] = index
+    return listing[2]
+
+
 def check_file_existence(files):
+    """
+    Return the files that exist and those do not. A file can be a pattern,
+    and the last match is used. For a name with v* as its only wildcard,
+    this is the highest version.
+    """
     exist_files = []
     nonexist_files = []
     for file in files:
         path = os.path.dirname(file)
         base = os.path.basename(file)
-        f = [str(file) for file in Path(path).glob(base)]
-        try:
-            file = (sorted(f))[-1]
-            exist_files.append(file)
-        except:
+        name = None
+        if 'v*' in base and base.count('*') == 1 and '?' not in base and '[' not in base:
+            name = version_index(path).get(base, None)
+        # Versions like v02a are not in the index.
+        if name is None:
+            f = fnmatch.filter(list_dir(path), base)
+            name = f[-1] if len(f) != 0 else None
+        if name is None:
             nonexist_files.append(file)
+        else:
+            exist_files.append(os.path.join(path, name))
     return exist_files, nonexist_files
 
 
+# File times and names planned for time ranges, keyed by
+# (pattern, time range, cadence, valid range). Pattern None is for file times.
+max_file_plans = 64
+_file_plans = OrderedDict()
+
+
+def plan_files(pattern, time_range, cadence='day', valid_range=None):
+    """
+    Return the file times and the file names of a pattern for a time range.
+    The result is cached, so the same request is planned only once.
+    :return: file_times, files.
+    """
+    key = (pattern,
+        None if time_range is None else tuple(time_range), cadence,
+        None if valid_range is None else tuple(valid_range))
+    plan = _file_plans.get(key, None)
+    if plan is None:
+        if pattern is None:
+            file_times = break_down_times(validate_time_range(time_range, valid_range), cadence)
+            files = []
+        else:
+            file_times = plan_files(None, time_range, cadence, valid_range)[0]
+            files = epoch.convert_time(file_times, input='unix', output=pattern)
+        plan = (file_times, files)
+        _file_plans[key] = plan
+        while len(_file_plans) > max_file_plans:
+            _file_plans.popitem(last=False)
+    else:
+        _file_plans.move_to_end(key)
+    # Copy, so callers can change them.
+    return copy.copy(plan[0]), copy.copy(plan[1])
+
+
 
 def prepare_files(request):
     """
@@ -398,6 +1102,7 @@ def prepare_files(request):
 
     # file_times. This is used to replace pattern to actual file names.
     file_times = request.get('file_times', [])
+    plan = None
     if len(file_times) == 0:
         # Need to get file_times from time_range.
 
@@ -410,10 +1115,9 @@ def prepare_files(request):
         # valid_range. By default is a pair of unix timestamps.
         valid_range = prepare_time_range(request.get('valid_range', None))
 
-        # validated_time_range. By default is time_range.
-        validated_time_range = validate_time_range(time_range, valid_range)
-
-        file_times = break_down_times(validated_time_range, cadence)
+        # validated_time_range, by default is time_range, is applied in plan_files.
+        plan = dict(time_range=time_range, cadence=cadence, valid_range=valid_range)
+        file_times = plan_files(None, **plan)[0]
         request['file_times'] = file_times
     else: request['file_times'] = []
 
@@ -424,7 +1128,10 @@ def prepare_files(request):
         # local_pattern. This is used to be replaced by file_times to get local_file.
         local_pattern = request.get('local_pattern', None)
         if not (local_pattern is None or file_times is None):
-            local_files = epoch.convert_time(file_times, input='unix', output=local_pattern)
+            if plan is None:
+                local_files = epoch.convert_time(file_times, input='unix', output=local_pattern)
+            else:
+                local_files = plan_files(local_pattern, **plan)[1]
             request['local_files'] = local_files
     else: request['local_files'] = []
 
@@ -443,16 +1150,22 @@ def prepare_files(request):
         # remote_pattern. This is used to be replaced by file_times to get remote_file.
         remote_pattern = request.get('remote_pattern', None)
         if not (remote_pattern is None or file_times is None):
-            remote_files = epoch.convert_time(file_times, input='unix', output=remote_pattern)
+            if plan is None:
+                remote_files = epoch.convert_time(file_times, input='unix', output=remote_pattern)
+            else:
+                remote_files = plan_files(remote_pattern, **plan)[1]
             request['remote_files'] = remote_files
     else: request['remote_files'] = []
 
 
     # Sync with the server.
     if len(remote_files) != 0:
-        downloaded_files = []
-        for remote_file, local_file in zip(remote_files,local_files):
-            downloaded_files.append(system.download_file(remote_file,local_file))
+        downloaded_files = system.download_files(remote_files, local_files,
+            workers=request.get('download_workers', None))
+        # Keep the failed ones, to be reported as nonexist_files.
+        downloaded_files = [local_file if file is None else file
+            for file, local_file in zip(downloaded_files,local_files)]
+        clear_dir_listings(downloaded_files)
     else:
         downloaded_files = local_files
 
@@ -555,13 +1268,13 @@ def break_down_times(time, cadence='day'):
 
     times = math.mkarthm(t0, t1, ntime+1, 'n')
     if format is not None:
-        str_times = time_string(times, fmt=format)
-        times = time_double(math.sort_uniq(str_times))
+        str_times = epoch.format_time(times, format)
+        times = epoch.parse_time(np.unique(str_times), format).tolist()
 
     return times
 
 
-def cotran(in_var, out_var=None, coord_in=None, coord_out=None, probe=None):
+def cotran(in_var, out_var=None, coord_in=None, coord_out=None, probe=None, cadence=None):
     
     if coord_in is None:
         coord_in = get_setting(in_var, 'coord')
@@ -573,8 +1286,8 @@ def cotran(in_var, out_var=None, coord_in=None, coord_out=None, probe=None):
     setting = get_setting(in_var)
     setting['coord'] = coord_out
 
-    vec_out = lib_cotran(list(vec_in), list(times),
-        input=coord_in, output=coord_out, probe=probe)
+    vec_out = lib_cotran(vec_in, times,
+        input=coord_in, output=coord_out, probe=probe, cadence=cadence)
     
     if out_var is None:
         out_var = in_var.replace(coord_in, coord_out)
@@ -0,0 +1,245 @@
+import os
+import atexit
+import pickle
+import shutil
+import tempfile
+import itertools
+import numpy as np
+import xarray as xr
+from collections import OrderedDict
+from collections.abc import MutableMapping
+
+
+class _spill:
+    """
+    A var written to the spill dir, as <file>.npy for the data and <file>.pkl for dims and attrs.
+    """
+    def __init__(self, file):
+        self.file = file
+
+    def write(self, data):
+        np.save(self.file+'.npy', data.values, allow_pickle=False)
+        with open(self.file+'.pkl', 'wb') as f:
+            pickle.dump({'dims': data.dims, 'name': data.name, 'attrs': dict(data.attrs)}, f)
+
+    def read(self):
+        # Copy on write, so changes in memory do not go to the file.
+        values = np.load(self.file+'.npy', mmap_mode='c')
+        with open(self.file+'.pkl', 'rb') as f:
+            info = pickle.load(f)
+        return xr.DataArray(values, dims=info['dims'], name=info['name'], attrs=info['attrs'])
+
+    def remove(self):
+        # A mapped file may not be removed on some systems, then it is removed with the dir.
+        for ext in ['.npy','.pkl']:
+            try:
+                os.remove(self.file+ext)
+            except OSError:
+                pass
+
+
+class var_store(MutableMapping):
+    """
+    A dict of var names to xr.DataArray, with an optional memory budget.
+
+    Vars read from files record their source, which the loader reads to return the var again.
+    When the vars in memory exceed max_bytes, the least recently used vars with a source are dropped,
+    keeping their settings, and are read again on next access. Vars without a source are kept,
+    or written to spill_dir if spill is set, and mapped back from disk on next access.
+    A var can also be set lazily, with only its source and settings, to be read on first access.
+
+    A var mapped back from spill_dir is not counted in max_bytes, since the system pages it from
+    its files, which are kept until the var is set again or deleted. It is mapped copy on write,
+    so changing its values in place is lost if it is dropped again; use update_data to keep them.
+    """
+
+    def __init__(self, vars=None, max_bytes=None, loader=None, spill=False, spill_dir=None):
+        """
+        :param vars: a dict of vars to start with.
+        :param max_bytes: the memory budget in bytes, or None for no limit.
+        :param loader: a function to read a source and return the var, without changing the store.
+        :param spill: set to write vars without a source to disk when dropped.
+        :param spill_dir: the dir to write to. By default, a temporary dir removed at exit.
+        """
+        # Vars in memory, in the order of use, and their sizes.
+        self._vars = OrderedDict()
+        self._nbytes = dict()
+        self.nbyte = 0
+        # Sources of vars, and dropped vars as (source, attrs).
+        self._sources = dict()
+        self._evicted = dict()
+        self.max_bytes = max_bytes
+        self.loader = loader
+        self.spill = spill
+        self.spill_dir = spill_dir
+        self._spill_ids = itertools.count()
+        if vars is not None: self.update(vars)
+
+
+    def __getitem__(self, var):
+        if var in self._vars:
+            self._vars.move_to_end(var)
+            return self._vars[var]
+        if var in self._evicted:
+            return self._reload(var)
+        raise KeyError(var)
+
+    def __setitem__(self, var, data):
+        # New data no longer come from the source.
+        self._clear_source(var)
+        self._forget(var)
+        self._put(var, data)
+        self.shrink(keep=var)
+
+    def __delitem__(self, var):
+        if var not in self: raise KeyError(var)
+        self._clear_source(var)
+        self._forget(var)
+        if var in self._vars: self._drop(var)
+
+    def __iter__(self):
+        yield from list(self._vars)
+        yield from list(self._evicted)
+
+    def __len__(self):
+        return len(self._vars)+len(self._evicted)
+
+    def __contains__(self, var):
+        return var in self._vars or var in self._evicted
+
+
+    def _put(self, var, data, nbyte=None):
+        if var in self._vars: self.nbyte -= self._nbytes[var]
+        self._vars[var] = data
+        self._vars.move_to_end(var)
+        self._nbytes[var] = data.nbytes if nbyte is None else nbyte
+        self.nbyte += self._nbytes[var]
+
+    def _drop(self, var):
+        self.nbyte -= self._nbytes.pop(var)
+        del self._vars[var]
+
+    def _forget(self, var):
+        # Remove a dropped var, and its files if spilled.
+        source, attrs = self._evicted.pop(var, (None, None))
+        if isinstance(source, _spill): source.remove()
+
+    def _clear_source(self, var):
+        # Remove the source of a var in memory, and its files if mapped from spill_dir.
+        source = self._sources.pop(var, None)
+        if isinstance(source, _spill): source.remove()
+
+
+    def set_source(self, var, source):
+        """
+        Record how to read a var again, source is passed to the loader.
+        """
+        if var not in self._vars: return
+        self._sources[var] = source
+
+    def set_lazy(self, var, source, attrs=None):
+        """
+        Set a var to be read from its source on first access. Its settings are available before.
+        """
+        self._clear_source(var)
+        self._forget(var)
+        if var in self._vars: self._drop(var)
+        self._evicted[var] = (source, dict() if attrs is None else attrs)
+
+    def attrs(self, var):
+        """
+        Return the settings of a var, without reading it if dropped.
+        """
+        if var in self._vars: return self._vars[var].attrs
+        if var in self._evicted: return self._evicted[var][1]
+        raise KeyError(var)
+
+    def get_source(self, var):
+        # Spill files are kept by the store, they are not a source to read from.
+        if var in self._evicted:
+            source = self._evicted[var][0]
+        else:
+            source = self._sources.get(var, None)
+        return None if isinstance(source, _spill) else source
+
+    def is_resident(self, var):
+        return var in self._vars
+
+    def rename(self, var, out_var):
+        """
+        Rename a var, keeping its source. A dropped var stays dropped.
+        """
+        if var == out_var: return
+        if var not in self: raise KeyError(var)
+        if out_var in self: del self[out_var]
+        if var in self._evicted:
+            self._evicted[out_var] = self._evicted.pop(var)
+            return
+        data = self._vars[var]
+        source = self._sources.pop(var, None)
+        nbyte = self._nbytes[var]
+        self._drop(var)
+        self._put(out_var, data, nbyte=nbyte)
+        if source is not None: self._sources[out_var] = source
+
+
+    def evict(self, var):
+        """
+        Drop a var from memory. It is read again from its source on next access.
+        """
+        if var not in self._sources: return False
+        self._evicted[var] = (self._sources.pop(var), self._vars[var].attrs)
+        self._drop(var)
+        return True
+
+    def spill_var(self, var):
+        """
+        Write a var to spill_dir and drop it from memory. It is mapped back from disk on next access.
+        """
+        data = self._vars[var]
+        # Objects, e.g., strings, cannot be mapped.
+        if data.dtype.hasobject: return False
+        if self.spill_dir is None:
+            self.spill_dir = tempfile.mkdtemp(prefix='pyslib_spill_')
+            atexit.register(shutil.rmtree, self.spill_dir, ignore_errors=True)
+        os.makedirs(self.spill_dir, exist_ok=True)
+        source = _spill(os.path.join(self.spill_dir, str(next(self._spill_ids))))
+        source.write(data)
+        self._evicted[var] = (source, data.attrs)
+        self._drop(var)
+        return True
+
+    def shrink(self, keep=None):
+        """
+        Drop the least recently used vars until the vars in memory fit in max_bytes.
+        :param keep: a var not to drop, e.g., the one just set.
+        """
+        if self.max_bytes is None: return
+        for var in list(self._vars):
+            if self.nbyte <= self.max_bytes: break
+            if var == keep or self._nbytes[var] == 0: continue
+            if var in self._sources:
+                self.evict(var)
+            elif self.spill:
+                self.spill_var(var)
+
+    def _reload(self, var):
+        source, attrs = self._evicted[var]
+        if isinstance(source, _spill):
+            # The files stay as the source, so dropping the var again does not write it again.
+            data = source.read()
+            data.attrs = attrs
+            del self._evicted[var]
+            self._put(var, data, nbyte=0)
+            self._sources[var] = source
+            return data
+        if self.loader is None: raise KeyError(var)
+        data = self.loader(source)
+
+        # The settings may have changed after reading.
+        data.attrs = attrs
+        del self._evicted[var]
+        self._put(var, data)
+        self._sources[var] = source
+        self.shrink(keep=var)
+        return data
@@ -0,0 +1,127 @@
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import unittest
+import http.server
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import libs.system as system
+
+
+class _range_handler(http.server.BaseHTTPRequestHandler):
+    """
+    Serve files under root, with Range requests as used to resume downloads.
+    The Range header of each request is kept in ranges.
+    """
+    root = None
+    ranges = list()
+
+    def do_GET(self):
+        file = os.path.join(self.root, self.path.lstrip('/'))
+        if not os.path.isfile(file):
+            self.send_error(404)
+            return
+        with open(file, 'rb') as f:
+            data = f.read()
+        header = self.headers.get('Range', None)
+        self.ranges.append(header)
+        offset = 0
+        if header is None:
+            self.send_response(200)
+        else:
+            offset = int(header[len('bytes='):].split('-')[0])
+            if offset >= len(data):
+                self.send_error(416)
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {offset}-{len(data)-1}/{len(data)}')
+        self.send_header('Content-Length', str(len(data)-offset))
+        self.end_headers()
+        self.wfile.write(data[offset:])
+
+    def log_message(self, *args):
+        pass
+
+
+class test_download(unittest.TestCase):
+
+    def setUp(self):
+        self.remote_dir = tempfile.mkdtemp()
+        self.local_dir = tempfile.mkdtemp()
+        self.data = os.urandom(3*system.download_chunk_size+123)
+        with open(os.path.join(self.remote_dir, 'data.cdf'), 'wb') as f:
+            f.write(self.data)
+
+        _range_handler.root = self.remote_dir
+        _range_handler.ranges = list()
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _range_handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f'http://127.0.0.1:{self.server.server_port}/'
+
+        # Keep the records of missing files out of the cache dir.
+        self.settings = (system.missing_file_record, system._missing_files, system.download_verbose)
+        record = os.path.join(self.local_dir, 'missing_files.json')
+        system.missing_file_record = lambda: record
+        system._missing_files = None
+        system.download_verbose = False
+
+    def tearDown(self):
+        system.missing_file_record, system._missing_files, system.download_verbose = self.settings
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.remote_dir, ignore_errors=True)
+        shutil.rmtree(self.local_dir, ignore_errors=True)
+
+    def read(self, file):
+        with open(file, 'rb') as f:
+            return f.read()
+
+    def test_complete(self):
+        local_file = os.path.join(self.local_dir, 'data.cdf')
+        self.assertEqual(system.download_file(self.url+'data.cdf', local_file), local_file)
+        self.assertEqual(self.read(local_file), self.data)
+        self.assertFalse(os.path.exists(local_file+'.part'))
+        self.assertEqual(_range_handler.ranges, [None])
+
+        # An existing file is not downloaded again.
+        self.assertEqual(system.download_file(self.url+'data.cdf', local_file), local_file)
+        self.assertEqual(_range_handler.ranges, [None])
+
+    def test_resume(self):
+        local_file = os.path.join(self.local_dir, 'data.cdf')
+        offset = system.download_chunk_size+7
+        with open(local_file+'.part', 'wb') as f:
+            f.write(self.data[:offset])
+        self.assertEqual(system.download_file(self.url+'data.cdf', local_file), local_file)
+        self.assertEqual(self.read(local_file), self.data)
+        self.assertFalse(os.path.exists(local_file+'.part'))
+        self.assertEqual(_range_handler.ranges, [f'bytes={offset}-'])
+
+    def test_restart(self):
+        # A partial file longer than the remote file is not part of it.
+        local_file = os.path.join(self.local_dir, 'data.cdf')
+        with open(local_file+'.part', 'wb') as f:
+            f.write(os.urandom(len(self.data)+10))
+        self.assertEqual(system.download_file(self.url+'data.cdf', local_file), local_file)
+        self.assertEqual(self.read(local_file), self.data)
+        self.assertEqual(_range_handler.ranges, [f'bytes={len(self.data)+10}-', None])
+
+    def test_missing(self):
+        local_file = os.path.join(self.local_dir, 'none.cdf')
+        self.assertIsNone(system.download_file(self.url+'none.cdf', local_file))
+        self.assertFalse(os.path.exists(local_file))
+        self.assertIsNotNone(system.is_missing(local_file))
+
+        # Not tried again while recorded as missing.
+        with open(os.path.join(self.remote_dir, 'none.cdf'), 'wb') as f:
+            f.write(self.data)
+        self.assertIsNone(system.download_file(self.url+'none.cdf', local_file))
+        self.assertEqual(_range_handler.ranges, [])
+        system.unmark_missing(local_file)
+        self.assertEqual(system.download_file(self.url+'none.cdf', local_file), local_file)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import unittest
+import importlib.util
+import numpy as np
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+# system.manager keeps its data in the pyslib package, i.e., this repo.
+if importlib.util.find_spec('pyslib') is None:
+    spec = importlib.util.spec_from_file_location('pyslib', os.path.join(root, '__init__.py'))
+    sys.modules['pyslib'] = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(sys.modules['pyslib'])
+import benchmark
+import libs.cdf
+import system.manager as smg
+
+
+class test_parallel_read(unittest.TestCase):
+    """
+    Read more files than max_open_files with threads, so the pool evicts handles during a read.
+    """
+
+    def setUp(self):
+        self.file_dir = tempfile.mkdtemp()
+        self.files = benchmark.make_files(self.file_dir, nfile=12, nrec=500)
+        self.rec_range = [[] for file in self.files]
+        self.settings = (libs.cdf.max_open_files, libs.cdf.pycdf.CDF)
+        libs.cdf.max_open_files = 4
+
+        # Record the threads that open files with the CDF library behind pycdf.
+        self.threads = set()
+        def open_pycdf(*args, **kwargs):
+            self.threads.add(threading.get_ident())
+            return self.settings[1](*args, **kwargs)
+        libs.cdf.pycdf.CDF = open_pycdf
+
+    def tearDown(self):
+        libs.cdf.close_cdf()
+        libs.cdf.max_open_files, libs.cdf.pycdf.CDF = self.settings
+        shutil.rmtree(self.file_dir, ignore_errors=True)
+
+    def test_thread(self):
+        data = smg._cdf_read_vars(['vb1','unix_time'], self.files, rec_range=self.rec_range, step=3)
+        for mmap in [False, True]:
+            for i in range(5):
+                libs.cdf.close_cdf()
+                the_data = smg._cdf_read_vars(['vb1','unix_time'], self.files, rec_range=self.rec_range,
+                    step=3, workers=4, executor='thread', mmap=mmap)
+                for var in ['vb1','unix_time']:
+                    self.assertTrue(np.array_equal(the_data[var][0], data[var][0]))
+        self.assertEqual(self.threads, {threading.get_ident()})
+
+
+if __name__ == '__main__':
+    unittest.main()